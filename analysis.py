@@ -0,0 +1,778 @@
+# analysis.py - Image feature extraction and risk scoring
+from PIL import Image, ImageFilter
+import numpy as np
+from datetime import datetime
+import functools
+import io
+import math
+import time
+
+from filter_backends import get_backend
+from tiff_regions import open_regions
+
+# Bump when the feature extraction or the risk thresholds change so cached
+# results computed by an older pipeline are not reused
+ANALYSIS_VERSION = '4'
+THRESHOLD_VERSION = '1'
+
+# Risk scoring table per THRESHOLD_VERSION.  Each rule awards the points of the
+# first tier whose bound the feature exceeds (tiers from the highest bound down);
+# levels are (minimum score, level, recommendation, color class) from low to high.
+RISK_THRESHOLDS = {
+    '1': {
+        'rules': (
+            ('asymmetry_score', ((50, 3, "High asymmetry detected"),
+                                 (30, 1, "Moderate asymmetry"))),
+            ('color_variation', ((40, 2, "Significant color variation"),
+                                 (25, 1, "Some color variation"))),
+            ('border_irregularity', ((30, 2, "Irregular borders detected"),
+                                     (20, 1, "Some border irregularity"))),
+        ),
+        'levels': (
+            (0, "LOW", "Continue regular self-examinations", "success"),
+            (3, "MODERATE", "Consider scheduling dermatologist appointment", "warning"),
+            (5, "HIGH", "Strongly recommend immediate dermatologist consultation", "danger"),
+        ),
+        'max_score': 7,
+    },
+}
+
+CONTRAST_FACTOR = 1.2
+BLUR_RADIUS = 1
+BAND_ROWS = 256  # rows processed per band by the fused extractor
+BAND_HALO = 8  # extra rows around each band so the filters see their true neighbours
+
+# The fused extractor walks the decoded frame in full-width bands and never
+# materialises a full-size contrast, blur or float copy of the image.  Every
+# feature is accumulated from exact uint8 histograms and integer sums, and
+# the halo rows are wide enough for the blur (3 box passes, 1px each at
+# radius 1) and the 3x3 edge kernel, so results match the original
+# full-frame pipeline to within FEATURE_TOLERANCE (float rounding only).
+FEATURE_TOLERANCE = 1e-6
+
+# TIFFs above this many pixels are analyzed region by region straight from
+# the file (see extract_features_tiled) instead of being decoded in full
+TILED_MIN_PIXELS = 50_000_000
+TILE_EDGE = 512  # columns per region in tiled mode (strip files use whole rows)
+
+# Lesion localization (locate_lesion): an Otsu threshold on a small blurred
+# grayscale copy separates the darker lesion from the skin around it
+ROI_EDGE = 256  # long edge of the copy the lesion is located on
+ROI_BLUR_RADIUS = 2
+ROI_MIN_SEPARATION = 0.75  # share of the gray variance the threshold must explain
+ROI_MIN_CONTRAST = 20  # gray levels between the mean lesion and mean skin tone
+ROI_MIN_AREA = 0.002  # lesion share of the frame, outside which the whole frame is used
+ROI_MAX_AREA = 0.8
+ROI_TRIM = 0.01  # fraction of stray dark pixels ignored on each side of the box
+ROI_MARGIN = 0.25  # skin kept around the lesion, relative to its size, for the border terms
+
+HASH_SIZE = 8  # the perceptual hash keeps the lowest 8x8 DCT frequencies: 64 bits
+HASH_CELLS = 32  # grid of gray cells the DCT is taken over
+# Every hash is taken from the image decoded and box-reduced to this long
+# edge (see hash_image), however the image was decoded for analysis
+HASH_EDGE = ROI_EDGE
+
+
+def _contrast_lut(mean, factor=CONTRAST_FACTOR):
+    """Build the per-channel lookup table equivalent to ImageEnhance.Contrast"""
+    levels = np.arange(256, dtype=np.float32)
+    stretched = np.float32(mean) + np.float32(factor) * (levels - np.float32(mean))
+    return np.clip(stretched, 0, 255).astype(np.uint8).tolist()
+
+
+def _histogram_stats(histogram):
+    """Return per-band (mean, std) from a PIL histogram of 256 bins per band"""
+    bins = np.asarray(histogram, dtype=np.float64).reshape(-1, 256)
+    levels = np.arange(256, dtype=np.float64)
+    counts = bins.sum(axis=1)
+    means = bins @ levels / counts
+    variances = bins @ (levels ** 2) / counts - means ** 2
+    return means, np.sqrt(np.maximum(variances, 0))
+
+
+def _bands(height, halo):
+    """Yield (top, bottom, halo_top, halo_bottom) row ranges covering an image"""
+    for top in range(0, height, BAND_ROWS):
+        bottom = min(top + BAND_ROWS, height)
+        yield top, bottom, max(0, top - halo), min(height, bottom + halo)
+
+
+def _asymmetry_sum(pixels, buffer):
+    """Sum of |left half - mirrored right half| for one band of pixels"""
+    half = pixels.shape[1] // 2
+    diff = buffer[:pixels.shape[0]]
+    np.subtract(pixels[:, :half], pixels[:, pixels.shape[1] - half:][:, ::-1],
+                out=diff, dtype=np.int16)
+    np.abs(diff, out=diff)
+    return int(diff.sum(dtype=np.int64))
+
+
+class StageTimer:
+    """Accumulates wall-clock time per pipeline stage into a dict (or does nothing)"""
+
+    def __init__(self, timings=None):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """Charge the time since the previous lap to the given stage"""
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+def extract_features(image, timings=None, backend=None):
+    """Compute the lesion features of a decoded PIL image in a single pass
+
+    The filters run on the named backend (see filter_backends), by default
+    the fastest one on this host.
+    If a timings dict is given, seconds spent per stage are added to it.
+    """
+    clock = StageTimer(timings)
+    filters = get_backend(backend)
+    width, height = image.size
+    half = width // 2
+
+    # 1. Grayscale plane, shared by the contrast mean and the edge detector
+    if image.mode == 'RGB':
+        gray = image.convert('L')
+    else:
+        gray = Image.new('L', image.size)
+        for top, bottom, _, _ in _bands(height, 0):
+            band = image.crop((0, top, width, bottom)).convert('RGB')
+            gray.paste(band.convert('L'), (0, top))
+    clock.lap('convert')
+    gray_mean, _ = _histogram_stats(gray.histogram())
+    lut = _contrast_lut(int(gray_mean[0] + 0.5))
+    clock.lap('contrast')
+
+    color_histogram = np.zeros(768, dtype=np.int64)
+    edge_histogram = np.zeros(256, dtype=np.int64)
+    asymmetry_total = 0
+    # One int16 buffer reused by every band for the half-vs-half difference
+    buffer = np.empty((BAND_ROWS, half, 3), dtype=np.int16)
+
+    for top, bottom, halo_top, halo_bottom in _bands(height, BAND_HALO):
+        band = image.crop((0, halo_top, width, halo_bottom))
+        if band.mode != 'RGB':
+            band = band.convert('RGB')
+        band = filters.load(band)
+        clock.lap('convert')
+
+        # 2. Enhance contrast through a lookup table (no degenerate image)
+        band = filters.contrast(band, lut)
+        clock.lap('contrast')
+
+        # 3. Apply Gaussian blur for noise reduction, then drop the halo rows
+        band = filters.blur(band, BLUR_RADIUS)
+        band = filters.crop(band, (0, top - halo_top, width, bottom - halo_top))
+        clock.lap('blur')
+
+        # 4. Color statistics straight from the uint8 histogram
+        color_histogram += filters.histogram(band)
+        clock.lap('color_stats')
+
+        # 5. Asymmetry detection on this band
+        if half:
+            asymmetry_total += _asymmetry_sum(filters.pixels(band), buffer)
+        clock.lap('asymmetry')
+
+        # 6. Edge detection for border irregularity
+        edge_top, edge_bottom = max(0, top - 1), min(height, bottom + 1)
+        edges = filters.edges(filters.load(gray.crop((0, edge_top, width, edge_bottom))))
+        edge_histogram += filters.histogram(filters.crop(edges, (0, top - edge_top, width, bottom - edge_top)))
+        clock.lap('edges')
+
+    avg_color, color_std = _histogram_stats(color_histogram)
+    _, edge_std = _histogram_stats(edge_histogram)
+    asymmetry_score = asymmetry_total / (height * half * 3) if half else 0.0
+
+    return {
+        'image_size': image.size,
+        'avg_color': avg_color.tolist(),
+        'color_variation': float(np.mean(color_std)),
+        'asymmetry_score': float(asymmetry_score),
+        'border_irregularity': float(edge_std[0])
+    }
+
+
+def _gray(image):
+    """Grayscale plane of a region, converted the way extract_features does it"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image.convert('L')
+
+
+def _expand(box, halo, size):
+    """Grow a box by halo pixels on every side, clipped to the image"""
+    left, top, right, bottom = box
+    return (max(0, left - halo), max(0, top - halo),
+            min(size[0], right + halo), min(size[1], bottom + halo))
+
+
+def _inner(filters, frame, box, outer):
+    """Crop the part of a region read with context back to the box itself"""
+    return filters.crop(frame, (box[0] - outer[0], box[1] - outer[1],
+                                box[2] - outer[0], box[3] - outer[1]))
+
+
+def extract_features_tiled(reader, timings=None, backend=None):
+    """Compute the same features as extract_features one region at a time
+
+    reader is a tiff_regions.TiffRegionReader.  A first pass over the
+    strips/tiles gathers the grayscale histogram for the contrast mean; the
+    second walks column pairs mirrored about the vertical centre line (so
+    asymmetry compares regions that are both in memory) and top to bottom
+    within each pair.  Each region is read with BAND_HALO pixels of context
+    on every side for the blur and 1 pixel for the edge kernel, then
+    trimmed, so seams between regions match the full-frame filters exactly.
+    Color and edge statistics come from exact uint8 histograms, which
+    merge across regions without any loss, and the asymmetry from an
+    integer sum.  Memory is bounded by a few regions and the reader's
+    chunk cache, not by the image size.
+    """
+    clock = StageTimer(timings)
+    filters = get_backend(backend)
+    width, height = reader.size
+    half = width // 2
+
+    # 1. Grayscale histogram for the contrast mean, one chunk at a time
+    gray_histogram = np.zeros(256, dtype=np.int64)
+    for _, chunk in reader.chunks():
+        clock.lap('decode')
+        gray_histogram += _gray(chunk).histogram()
+        clock.lap('convert')
+    gray_mean, _ = _histogram_stats(gray_histogram)
+    lut = _contrast_lut(int(gray_mean[0] + 0.5))
+    clock.lap('contrast')
+
+    color_histogram = np.zeros(768, dtype=np.int64)
+    edge_histogram = np.zeros(256, dtype=np.int64)
+    asymmetry_total = 0
+
+    def blurred(box):
+        outer = _expand(box, BAND_HALO, reader.size)
+        region = reader.region(outer)
+        clock.lap('decode')
+        if region.mode != 'RGB':
+            region = region.convert('RGB')
+        region = filters.load(region)
+        clock.lap('convert')
+        region = filters.contrast(region, lut)
+        clock.lap('contrast')
+        region = _inner(filters, filters.blur(region, BLUR_RADIUS), box, outer)
+        clock.lap('blur')
+        color_histogram[:] += filters.histogram(region)
+        clock.lap('color_stats')
+        return filters.pixels(region)
+
+    def edges(box):
+        outer = _expand(box, 1, reader.size)
+        region = filters.load(_gray(reader.region(outer)))
+        clock.lap('decode')
+        edge_histogram[:] += filters.histogram(_inner(filters, filters.edges(region), box, outer))
+        clock.lap('edges')
+
+    # Columns [x0, x1) of the left half pair with [width - x1, width - x0);
+    # an odd width leaves the centre column, which only feeds the histograms
+    columns = TILE_EDGE if reader.tiled else max(half, 1)
+    pairs = [(x0, min(x0 + columns, half)) for x0 in range(0, half, columns)]
+    for x0, x1 in pairs:
+        for top in range(0, height, BAND_ROWS):
+            bottom = min(top + BAND_ROWS, height)
+            left = blurred((x0, top, x1, bottom))
+            right = blurred((width - x1, top, width - x0, bottom))
+            diff = np.abs(left.astype(np.int16) - right[:, ::-1])
+            asymmetry_total += int(diff.sum(dtype=np.int64))
+            clock.lap('asymmetry')
+            edges((x0, top, x1, bottom))
+            edges((width - x1, top, width - x0, bottom))
+    if width - 2 * half:
+        for top in range(0, height, BAND_ROWS):
+            box = (half, top, width - half, min(top + BAND_ROWS, height))
+            blurred(box)
+            edges(box)
+
+    avg_color, color_std = _histogram_stats(color_histogram)
+    _, edge_std = _histogram_stats(edge_histogram)
+    asymmetry_score = asymmetry_total / (height * half * 3) if half else 0.0
+
+    return {
+        'image_size': reader.size,
+        'avg_color': avg_color.tolist(),
+        'color_variation': float(np.mean(color_std)),
+        'asymmetry_score': float(asymmetry_score),
+        'border_irregularity': float(edge_std[0])
+    }
+
+
+def reduce_tiled(reader, max_edge):
+    """Box-reduce a TIFF region by region to a working image of at most max_edge
+
+    Regions are aligned to the reduction factor, so the result equals
+    reduce_for_analysis on the fully decoded image.
+    """
+    return reduce_tiled_each(reader, [max_edge])[0]
+
+
+def reduce_tiled_each(reader, edges):
+    """reduce_tiled to each of several long edges, in one pass over the file
+    when their reduction factors share small enough aligned regions"""
+    factors = [math.ceil(max(reader.size) / edge) for edge in edges]
+    step = math.lcm(*factors)
+    if step > 4 * TILE_EDGE:
+        return [reduce_tiled_each(reader, [edge])[0] for edge in edges]
+    edge = -(-TILE_EDGE // step) * step
+    width, height = reader.size
+    working = [None] * len(factors)
+    for top in range(0, height, edge):
+        for left in range(0, width, edge):
+            region = reader.region((left, top, min(left + edge, width), min(top + edge, height)))
+            if region.mode not in ('L', 'RGB', 'RGBA', 'CMYK'):
+                region = region.convert('RGB')
+            for i, factor in enumerate(factors):
+                reduced = region.reduce(factor) if factor > 1 else region
+                if working[i] is None:
+                    working[i] = Image.new(reduced.mode, (-(-width // factor), -(-height // factor)))
+                working[i].paste(reduced, (left // factor, top // factor))
+    return working
+
+
+def _otsu(histogram):
+    """Otsu threshold of a 256-bin histogram, the share of variance it explains
+    and the distance between the means of the two classes"""
+    counts = np.asarray(histogram, dtype=np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    total = counts.sum()
+    weight = np.cumsum(counts) / total
+    mean = np.cumsum(counts * levels) / total
+    mean_total = mean[-1]
+    variance = counts @ (levels - mean_total) ** 2 / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean_total * weight - mean) ** 2 / (weight * (1 - weight))
+    between = np.nan_to_num(between, nan=0.0, posinf=0.0)
+    threshold = int(np.argmax(between))
+    if not variance or weight[threshold] in (0, 1):
+        return threshold, 0.0, 0.0
+    low = mean[threshold] / weight[threshold]
+    high = (mean_total - mean[threshold]) / (1 - weight[threshold])
+    return threshold, between[threshold] / variance, high - low
+
+
+def locate_lesion(image):
+    """Bounding box of the lesion in an image, or None when none stands out
+
+    The image is box-reduced to ROI_EDGE, blurred and thresholded with
+    Otsu's method; the box around the darker pixels (ignoring ROI_TRIM
+    stray pixels per side) is padded by ROI_MARGIN and returned as
+    (left, top, right, bottom) in the coordinates of image.
+    """
+    factor = max(1, math.ceil(max(image.size) / ROI_EDGE))
+    small = image
+    if small.mode not in ('L', 'RGB', 'RGBA', 'CMYK'):
+        small = small.convert('RGB')
+    if factor > 1:
+        small = small.reduce(factor)
+    return _lesion_box(small, factor, image.size)
+
+
+def _lesion_box(small, factor, size):
+    """locate_lesion on a copy already box-reduced by factor from an image of the given size"""
+    gray = _gray(small).filter(ImageFilter.GaussianBlur(radius=ROI_BLUR_RADIUS))
+
+    threshold, separation, contrast = _otsu(gray.histogram())
+    if separation < ROI_MIN_SEPARATION or contrast < ROI_MIN_CONTRAST:
+        return None
+    # Opening (erode, then dilate) drops specks such as pores and hairs
+    mask = gray.point(lambda value: 255 if value <= threshold else 0)
+    mask = mask.filter(ImageFilter.MinFilter(3)).filter(ImageFilter.MaxFilter(3))
+    rows, columns = np.nonzero(np.asarray(mask))
+    if not ROI_MIN_AREA <= len(rows) / (small.size[0] * small.size[1]) <= ROI_MAX_AREA:
+        return None
+
+    top, bottom = np.quantile(rows, [ROI_TRIM, 1 - ROI_TRIM])
+    left, right = np.quantile(columns, [ROI_TRIM, 1 - ROI_TRIM])
+    pad_x = (right - left + 1) * ROI_MARGIN
+    pad_y = (bottom - top + 1) * ROI_MARGIN
+    width, height = size
+    return (max(0, int((left - pad_x) * factor)), max(0, int((top - pad_y) * factor)),
+            min(width, math.ceil((right + 1 + pad_x) * factor)),
+            min(height, math.ceil((bottom + 1 + pad_y) * factor)))
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis, one frequency per row"""
+    k = np.arange(size)
+    basis = np.sqrt(2 / size) * np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    basis[0] /= np.sqrt(2)
+    return basis
+
+
+def perceptual_hash(image):
+    """64-bit perceptual hash (pHash) of an image, as 16 hex digits
+
+    The image is shrunk to HASH_CELLS x HASH_CELLS gray cells; each bit
+    records whether one of the lowest 8x8 DCT frequencies is above their
+    median.  Rescaling, recompression and exposure or contrast changes
+    leave it (nearly) unchanged, so photos of the same lesion differ in
+    only a few bits.
+    """
+    if image.mode not in ('L', 'RGB', 'RGBA', 'CMYK'):
+        image = image.convert('RGB')
+    factor = max(1, min(image.size) // (HASH_CELLS * 4))
+    if factor > 1:
+        image = image.reduce(factor)
+    cells = np.asarray(_gray(image).resize((HASH_CELLS, HASH_CELLS), Image.Resampling.BOX),
+                       dtype=np.float64)
+    basis = _dct_matrix(HASH_CELLS)
+    coefficients = (basis @ cells @ basis.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only reflects overall brightness, so it is left out of the median
+    bits = np.packbits(coefficients > np.median(coefficients[1:]))
+    return bits.tobytes().hex()
+
+
+def hash_image(image):
+    """Perceptual hash of an opened image, from its decode box-reduced to HASH_EDGE
+
+    This is the one input every path hashes, so the same file always
+    gets the same hash at every max_edge.  JPEGs are draft-decoded
+    (DCT-scaled) to at least HASH_EDGE, so they must be passed in before
+    anything else loaded them; other formats are decoded in full, and
+    reduce_tiled(reader, HASH_EDGE) gives exactly the same pixels for
+    TIFFs read region by region.
+    """
+    if image.format == 'JPEG':
+        image.draft('RGB', (HASH_EDGE, HASH_EDGE))
+    if image.mode not in ('L', 'RGB', 'RGBA', 'CMYK'):
+        image = image.convert('RGB')
+    factor = math.ceil(max(image.size) / HASH_EDGE)
+    if factor > 1:
+        image = image.reduce(factor)
+    return perceptual_hash(image)
+
+
+def hash_file(image_path):
+    """hash_image of an image file, reading large TIFFs region by region"""
+    reader = open_regions(image_path)
+    if reader is not None and reader.streamable and reader.size[0] * reader.size[1] > TILED_MIN_PIXELS:
+        with reader:
+            return hash_image(reduce_tiled(reader, HASH_EDGE))
+    if reader is not None:
+        reader.close()
+    with Image.open(image_path) as image:
+        return hash_image(image)
+
+
+def _scale_box(box, from_size, to_size):
+    """Map a box between two resolutions of the same image, rounding outwards"""
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    return (int(box[0] * sx), int(box[1] * sy),
+            min(to_size[0], math.ceil(box[2] * sx)), min(to_size[1], math.ceil(box[3] * sy)))
+
+
+def reduce_for_analysis(image, max_edge):
+    """Bound the long edge of an opened image, using JPEG draft decoding when possible"""
+    if not max_edge or max(image.size) <= max_edge:
+        return image
+
+    # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding; other
+    # formats are decoded in full and box-reduced by an integer factor
+    image.draft('RGB', (max_edge, max_edge))
+    factor = math.ceil(max(image.size) / max_edge)
+    if factor == 1:
+        return image
+    if image.mode not in ('L', 'RGB', 'RGBA', 'CMYK'):
+        image = image.convert('RGB')
+    return image.reduce(factor)
+
+
+def _frame_features(features, risk_assessment=None):
+    """The feature subset reported for a comparison frame"""
+    return {
+        'avg_color': features['avg_color'],
+        'color_variation': features['color_variation'],
+        'asymmetry_score': features['asymmetry_score'],
+        'border_irregularity': features['border_irregularity'],
+        'risk_assessment': risk_assessment or calculate_risk_score(features)
+    }
+
+
+def process_image_analysis(image_path, max_edge=None, timings=None, tiled=None, roi=False, compare=False,
+                           backend=None):
+    """Analyze skin lesion image using PIL
+
+    When max_edge is given the image is analyzed at a working resolution
+    whose long edge is at most max_edge pixels instead of at full size.
+    Striped and tiled TIFFs are read region by region when tiled is True,
+    or by default when they have more than TILED_MIN_PIXELS pixels.
+    With roi=True the features are computed on the lesion's bounding box
+    (see locate_lesion) rather than the whole frame, and compare=True adds
+    the whole-frame features under 'whole_frame'.
+    backend names the filter implementation (see filter_backends); every
+    backend gives the same features, so it only changes the speed.
+    If a timings dict is given, seconds spent per stage are added to it.
+    """
+    try:
+        clock = StageTimer(timings)
+        backend = get_backend(backend).name
+        box = whole = phash = None
+        reader = open_regions(image_path) if tiled is not False else None
+        if reader is not None and reader.streamable and (
+                tiled or reader.size[0] * reader.size[1] > TILED_MIN_PIXELS):
+            with reader:
+                image_size = reader.size
+                if max_edge and max(image_size) > max_edge:
+                    working_image, small = reduce_tiled_each(reader, [max_edge, HASH_EDGE])
+                    clock.lap('decode')
+                    phash = hash_image(small)
+                    clock.lap('hash')
+                    features, box, whole = _analyze_frame(working_image, roi, compare, timings, backend)
+                    if box is not None:
+                        box = _scale_box(box, working_image.size, image_size)
+                else:
+                    # One small copy serves the hash and the lesion search
+                    small = reduce_tiled(reader, HASH_EDGE)
+                    clock.lap('decode')
+                    phash = hash_image(small)
+                    clock.lap('hash')
+                    if roi:
+                        factor = max(1, math.ceil(max(image_size) / ROI_EDGE))
+                        box = _lesion_box(small, factor, image_size)
+                        clock.lap('roi')
+                    features = extract_features_tiled(reader.window(box) if box else reader,
+                                                      timings=timings, backend=backend)
+                    if compare:
+                        whole = extract_features_tiled(reader, backend=backend) if box else features
+        else:
+            if reader is not None:
+                reader.close()
+            with Image.open(image_path) as original_image:
+                image_size = original_image.size
+                if original_image.format == 'JPEG':
+                    # The hash has its own small draft decode; the working
+                    # image keeps the one that suits max_edge
+                    with Image.open(image_path) as hash_source:
+                        phash = hash_image(hash_source)
+                    clock.lap('hash')
+                working_image = reduce_for_analysis(original_image, max_edge)
+                working_image.load()
+                clock.lap('decode')
+                if phash is None:
+                    phash = hash_image(original_image)
+                clock.lap('hash')
+                features, box, whole = _analyze_frame(working_image, roi, compare, timings, backend)
+                if box is not None:
+                    box = _scale_box(box, working_image.size, image_size)
+
+        # Calculate risk score
+        clock = StageTimer(timings)
+        risk_assessment = calculate_risk_score(features)
+        clock.lap('scoring')
+
+        result = {
+            'success': True,
+            'image_size': image_size,
+            'analysis_size': features['image_size'],
+            'avg_color': features['avg_color'],
+            'color_variation': features['color_variation'],
+            'asymmetry_score': features['asymmetry_score'],
+            'border_irregularity': features['border_irregularity'],
+            'risk_assessment': risk_assessment,
+            'phash': phash,
+            'roi': {
+                'box': list(box),
+                'fraction': (box[2] - box[0]) * (box[3] - box[1]) / (image_size[0] * image_size[1])
+            } if box else None,
+            'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if compare:
+            result['whole_frame'] = _frame_features(whole, None if box else risk_assessment)
+        return result
+
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def _analyze_frame(image, roi, compare, timings, backend=None):
+    """Features of a decoded working image, cropped to the lesion when roi is set
+
+    Returns (features, lesion box or None, whole-frame features or None).
+    """
+    box = None
+    if roi:
+        clock = StageTimer(timings)
+        box = locate_lesion(image)
+        clock.lap('roi')
+    features = extract_features(image.crop(box) if box else image, timings=timings, backend=backend)
+    whole = None
+    if compare:
+        whole = extract_features(image, backend=backend) if box else features
+    return features, box, whole
+
+
+def analyze_image_bytes(data, max_edge=None, timings=None, roi=False, compare=False, backend=None):
+    """Analyze an uploaded image held in memory"""
+    return process_image_analysis(io.BytesIO(data), max_edge=max_edge, timings=timings,
+                                  roi=roi, compare=compare, backend=backend)
+
+
+
+PARITY_FEATURES = ('asymmetry_score', 'color_variation', 'border_irregularity')
+
+
+def analysis_parity(image_path, max_edge):
+    """Compare reduced-resolution features against a full-resolution analysis"""
+    started = time.perf_counter()
+    full = process_image_analysis(image_path)
+    full_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    reduced = process_image_analysis(image_path, max_edge=max_edge)
+    reduced_seconds = time.perf_counter() - started
+
+    if not full['success'] or not reduced['success']:
+        return {
+            'success': False,
+            'error': full.get('error') or reduced.get('error')
+        }
+
+    drift = {}
+    for feature in PARITY_FEATURES:
+        delta = reduced[feature] - full[feature]
+        drift[feature] = {
+            'full': full[feature],
+            'reduced': reduced[feature],
+            'delta': delta,
+            'relative': abs(delta) / full[feature] if full[feature] else 0.0
+        }
+
+    return {
+        'success': True,
+        'image_size': full['image_size'],
+        'analysis_size': reduced['analysis_size'],
+        'drift': drift,
+        'full_level': full['risk_assessment']['level'],
+        'reduced_level': reduced['risk_assessment']['level'],
+        'level_match': full['risk_assessment']['level'] == reduced['risk_assessment']['level'],
+        'full_seconds': full_seconds,
+        'reduced_seconds': reduced_seconds
+    }
+
+
+def backend_parity(image_path, backends=None):
+    """Analyze an image on every filter backend and measure the drift from PIL
+
+    The backends are meant to agree to within FEATURE_TOLERANCE; 'match'
+    is False when any feature drifts further than that.
+    """
+    from filter_backends import BACKENDS
+
+    results, seconds = {}, {}
+    for name in backends or BACKENDS:
+        started = time.perf_counter()
+        results[name] = process_image_analysis(image_path, backend=name)
+        seconds[name] = time.perf_counter() - started
+        if not results[name]['success']:
+            return {'success': False, 'error': f"{name}: {results[name]['error']}"}
+
+    reference = process_image_analysis(image_path, backend='pil') if 'pil' not in results else results['pil']
+    drift = {name: max(abs(result[feature] - reference[feature]) for feature in PARITY_FEATURES)
+             for name, result in results.items()}
+    return {
+        'success': True,
+        'image_size': reference['image_size'],
+        'drift': drift,
+        'match': max(drift.values()) <= FEATURE_TOLERANCE,
+        'seconds': seconds
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_thresholds(version):
+    """Arrays derived from a threshold table, built once per version"""
+    table = RISK_THRESHOLDS[version]
+    minimums = np.array([minimum for minimum, *_ in table['levels']])
+    names = np.array([name for _, name, *_ in table['levels']])
+    factors = tuple(factor for _, tiers in table['rules'] for _, _, factor in tiers)
+    return table, minimums, names, factors
+
+
+def score_batch(features, version=THRESHOLD_VERSION):
+    """Score many analyses at once
+
+    features maps each feature name used by the threshold table to an
+    array of values.  Returns (scores, levels, factor_masks) arrays; bit i
+    of a factor mask is set when the i-th entry of factor_names(version)
+    applied.
+    """
+    table, minimums, names, _ = _compiled_thresholds(version)
+    scores = None
+    bit = 0
+    for feature, tiers in table['rules']:
+        values = np.asarray(features[feature], dtype=np.float64)
+        if scores is None:
+            scores = np.zeros(values.shape, dtype=np.int64)
+            masks = np.zeros(values.shape, dtype=np.uint32)
+        # Tiers are ordered from the highest bound down; only the first match counts
+        unmatched = np.ones(values.shape, dtype=bool)
+        for above, points, _ in tiers:
+            hit = unmatched & (values > above)
+            scores += hit * points
+            masks |= hit.astype(np.uint32) << np.uint32(bit)
+            unmatched &= ~hit
+            bit += 1
+
+    levels = names[np.searchsorted(minimums, scores, side='right') - 1]
+    return scores, levels, masks
+
+
+def factor_names(version=THRESHOLD_VERSION):
+    """Risk factor descriptions in factor-mask bit order"""
+    return list(_compiled_thresholds(version)[3])
+
+
+def calculate_risk_score(analysis_data, version=THRESHOLD_VERSION):
+    """Calculate risk score based on image analysis"""
+    table, _, _, factors = _compiled_thresholds(version)
+    scores, levels, masks = score_batch(
+        {feature: analysis_data[feature] for feature, _ in table['rules']}, version)
+    level = str(levels)
+    mask = int(masks)
+    _, _, recommendation, color_class = next(entry for entry in table['levels'] if entry[1] == level)
+
+    return {
+        'score': int(scores),
+        'max_score': table['max_score'],
+        'level': level,
+        'factors': [factor for i, factor in enumerate(factors) if mask >> i & 1],
+        'recommendation': recommendation,
+        'color_class': color_class
+    }
+
+
+# Layout of the feature vector stored with each analysis (little-endian float64)
+FEATURE_FIELDS = ('asymmetry_score', 'color_variation', 'border_irregularity',
+                  'avg_red', 'avg_green', 'avg_blue')
+FEATURE_DTYPE = np.dtype('<f8')
+
+
+def pack_features(result):
+    """Serialize the features of an analysis result into a compact byte string"""
+    values = [result['asymmetry_score'], result['color_variation'], result['border_irregularity']]
+    values += list(result['avg_color'])[:3]
+    return np.asarray(values, dtype=FEATURE_DTYPE).tobytes()
+
+
+def unpack_features(blobs):
+    """Stack packed feature vectors into an (n, len(FEATURE_FIELDS)) array"""
+    return np.frombuffer(b''.join(blobs), dtype=FEATURE_DTYPE).reshape(-1, len(FEATURE_FIELDS))
+
+
+def score_feature_matrix(matrix, version=THRESHOLD_VERSION):
+    """Score rows of unpacked feature vectors: (scores, levels, factor_masks)"""
+    return score_batch({field: matrix[:, i] for i, field in enumerate(FEATURE_FIELDS)}, version)
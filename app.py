@@ -1,46 +1,228 @@
 # app.py - Main Flask application
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Request, current_app, render_template, request, jsonify, redirect, url_for, flash, send_file, session
+from flask.cli import with_appcontext
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageEnhance, ImageFilter
-import numpy as np
 import os
-import base64
 import io
 import uuid
-from datetime import datetime
+import json
+import sqlite3
+import threading
+from types import SimpleNamespace
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, event, func, inspect, or_, update
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, EmailField, SubmitField
-from wtforms.validators import InputRequired, Email, Length, EqualTo
-import bcrypt
+import click
+# Imaging (PIL, NumPy) and form (WTForms) modules are imported where they are
+# used, or ahead of time by warmup(), so importing the app stays cheap
+from result_cache import ResultCache
+from identity_cache import IdentityCache
+from page_cache import PageCache
+from engine import AnalysisEngine, EngineBusy
+from jobs import JobRunner
+from history_writer import HistoryWriter
+from metrics import MetricsRegistry
+from validation import HeaderSniffer, UploadRejected, validate_upload
+from thumbnails import RENDITIONS, ensure_rendition, generate_renditions, has_renditions, remove_renditions
+from blob_store import BlobStore, UploadCollector, collect_garbage, is_digest
+from similarity import SimilarityIndex
+from assets import AssetStore
 
-app = Flask(__name__, template_folder='Template')
-app.secret_key = 'skin-cancer-detection-tool-2024-secret-key'  # Change this in production
+class AnalysisRequest(Request):
+    """Request that keeps API uploads in memory and sniffs every upload as it arrives"""
 
-# Database Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///skin_cancer_detection.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path.startswith('/api/'):
+            # Bounded by MAX_CONTENT_LENGTH, so no temp file is ever needed
+            stream = io.BytesIO()
+        else:
+            stream = super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # Non-images and oversized images are dropped as soon as their header arrives
+        return HeaderSniffer(stream, current_app.config['MAX_IMAGE_PIXELS'],
+                             current_app.config['MAX_TIFF_PIXELS'])
 
 # Configuration
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+def default_config(instance_path):
+    """Application settings, with environment overrides"""
+    busy_timeout_ms = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    return {
+        'SECRET_KEY': 'skin-cancer-detection-tool-2024-secret-key',  # Change this in production
+        # Werkzeug debugger and tracebacks for local development only (FLASK_DEBUG=1)
+        'DEBUG': os.environ.get('FLASK_DEBUG', '0') == '1',
+
+        # Database Configuration
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///skin_cancer_detection.db',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # SQLite tuning: WAL lets readers run alongside the single writer, NORMAL
+        # synchronous only fsyncs at checkpoints (use FULL to fsync every commit),
+        # and writers wait busy_timeout ms for the lock instead of failing
+        'SQLITE_JOURNAL_MODE': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'SQLITE_SYNCHRONOUS': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'SQLITE_BUSY_TIMEOUT_MS': busy_timeout_ms,
+        'SQLALCHEMY_ENGINE_OPTIONS': {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': 10,
+            'connect_args': {'timeout': busy_timeout_ms / 1000}
+        },
+        # History inserts: 'sync' (commit per request, durable as SQLITE_SYNCHRONOUS allows),
+        # 'group' (shared commits with synchronous=FULL, durable before the response) or
+        # 'async' (write-behind, may lose the last few ms on a crash)
+        'HISTORY_WRITE_MODE': os.environ.get('HISTORY_WRITE_MODE', 'sync'),
+        'HISTORY_WRITE_INTERVAL': float(os.environ.get('HISTORY_WRITE_INTERVAL', 0.005)),
 
-# Initialize extensions
-db = SQLAlchemy(app)
+        'UPLOAD_FOLDER': UPLOAD_FOLDER,
+        'MAX_CONTENT_LENGTH': MAX_FILE_SIZE,
+        # Upload garbage collection: how often it runs in the background (0 disables),
+        # how long an upload nothing references yet is kept, and optionally how many
+        # days an original is kept after its last analysis (0 keeps them forever)
+        'UPLOAD_GC_INTERVAL': float(os.environ.get('UPLOAD_GC_INTERVAL', 3600)),
+        'UPLOAD_GC_GRACE': float(os.environ.get('UPLOAD_GC_GRACE', 3600)),
+        'UPLOAD_RETENTION_DAYS': float(os.environ.get('UPLOAD_RETENTION_DAYS', 0)),
+        # Earlier analyses of the same user listed with each result: at most
+        # SIMILAR_LIMIT whose perceptual hashes differ in at most SIMILAR_MAX_DISTANCE of 64 bits
+        'SIMILAR_MAX_DISTANCE': int(os.environ.get('SIMILAR_MAX_DISTANCE', 8)),
+        'SIMILAR_LIMIT': int(os.environ.get('SIMILAR_LIMIT', 5)),
+        'SIMILAR_INDEX_USERS': int(os.environ.get('SIMILAR_INDEX_USERS', 1024)),
+        # Long edge (px) of the working resolution used for analysis; 0 analyzes at full size
+        'ANALYSIS_MAX_EDGE': int(os.environ.get('ANALYSIS_MAX_EDGE', 0)),
+        # Crop to the located lesion before computing features (API callers can pass roi=0/1)
+        'ANALYSIS_ROI': os.environ.get('ANALYSIS_ROI', '0') == '1',
+        # Filter implementation: 'pil', 'numpy' or 'auto' (the fastest on this host,
+        # measured at warmup); API callers can pass backend=<name>
+        'ANALYSIS_BACKEND': os.environ.get('ANALYSIS_BACKEND', 'auto'),
+        # Batch API limits (the whole multipart request, not each file)
+        'BATCH_MAX_FILES': 50,
+        'BATCH_MAX_CONTENT_LENGTH': 256 * 1024 * 1024,
+        # Analysis worker processes (default: one per core, 0 runs inline) and how
+        # many analyses may wait for a worker before requests are turned away
+        'ANALYSIS_WORKERS': int(os.environ['ANALYSIS_WORKERS']) if 'ANALYSIS_WORKERS' in os.environ else None,
+        'ANALYSIS_QUEUE_SIZE': int(os.environ['ANALYSIS_QUEUE_SIZE']) if 'ANALYSIS_QUEUE_SIZE' in os.environ else None,
+        # Result cache: in-process LRU budget and persistent SQLite tier ('' disables it),
+        # which keeps the newest RESULT_CACHE_DB_ROWS results (0 keeps everything)
+        'RESULT_CACHE_MAX_BYTES': int(os.environ.get('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        'RESULT_CACHE_DB': os.environ.get('RESULT_CACHE_DB', os.path.join(instance_path, 'result_cache.db')),
+        'RESULT_CACHE_DB_ROWS': int(os.environ.get('RESULT_CACHE_DB_ROWS', 50_000)),
+        # Signed-in user lookups cached per process for USER_CACHE_TTL seconds (0 disables)
+        'USER_CACHE_TTL': float(os.environ.get('USER_CACHE_TTL', 60)),
+        'USER_CACHE_SIZE': int(os.environ.get('USER_CACHE_SIZE', 1024)),
+        # Rendered informational pages kept per process (0 disables; off in debug mode)
+        'PAGE_CACHE_SIZE': int(os.environ.get('PAGE_CACHE_SIZE', 256)),
+        # Pixel budget (width x height) checked from the image header before decoding
+        'MAX_IMAGE_PIXELS': int(os.environ.get('MAX_IMAGE_PIXELS', 100_000_000)),
+        # Striped/tiled TIFFs are analyzed region by region in bounded memory, so they may be larger
+        'MAX_TIFF_PIXELS': int(os.environ.get('MAX_TIFF_PIXELS', 1_000_000_000)),
+        # Prometheus metrics on /metrics (METRICS_ENABLED=0 turns instrumentation off)
+        'METRICS_ENABLED': os.environ.get('METRICS_ENABLED', '1') != '0',
+        # Re-hash static assets that changed on disk (always on in debug mode)
+        'ASSETS_WATCH': os.environ.get('ASSETS_WATCH', '0') == '1',
+    }
+
+# Static files every page loads, fingerprinted and compressed by warmup();
+# the only files served under /assets
+PAGE_ASSETS = ['css/animations.css', 'js/interactions.js']
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Initialize extensions (bound to the app in create_app)
+db = SQLAlchemy()
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 
-# Create upload directory if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+def sqlite_pragmas(config):
+    """Connect listener applying the SQLite pragmas to every new pooled connection"""
+    def configure_sqlite(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']}")
+        cursor.close()
+    return configure_sqlite
+
+# Keeps the user loader off the database for repeat page views
+identity_cache = IdentityCache()
+
+# Rendered /about, /cancer-types and /welcome pages (see render_cached)
+page_cache = PageCache()
+
+# Request and analysis metrics
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram('skin_request_seconds', 'Request latency by endpoint', ['endpoint'])
+REQUEST_STAGE_SECONDS = metrics.histogram('skin_request_stage_seconds',
+                                          'Time spent in each stage of a request', ['endpoint', 'stage'])
+ANALYSIS_STAGE_SECONDS = metrics.histogram('skin_analysis_stage_seconds',
+                                           'Time spent in each stage of an image analysis', ['stage'])
+REQUESTS_IN_FLIGHT = metrics.gauge('skin_requests_in_flight', 'Requests currently being handled', ['endpoint'])
+REQUEST_ERRORS = metrics.counter('skin_request_errors_total', 'Failed requests by endpoint and kind',
+                                 ['endpoint', 'kind'])
+STARTUP_SECONDS = metrics.gauge('skin_startup_seconds', 'Time to import and create the app, and to warm up',
+                                ['phase'])
+
+def record_analysis_timings(timings):
+    """Feed the per-stage timings of a finished analysis into the metrics"""
+    for stage, seconds in timings.items():
+        ANALYSIS_STAGE_SECONDS.observe(seconds, stage=stage)
+
+def track(endpoint):
+    """Record latency, in-flight count and uncaught errors of a view"""
+    return metrics.track(endpoint, REQUEST_SECONDS, REQUESTS_IN_FLIGHT, REQUEST_ERRORS)
+
+def stage(endpoint, name):
+    """Time one stage of a request"""
+    return metrics.time(REQUEST_STAGE_SECONDS, endpoint=endpoint, stage=name)
+
+metrics.gauge_callback('skin_analysis_in_flight', 'Analyses queued or running in the engine',
+                       lambda: engine.in_flight)
+metrics.gauge_callback('skin_analysis_capacity', 'Analyses the engine accepts at once',
+                       lambda: engine.capacity)
+metrics.counter_callback('skin_analysis_rejected_total', 'Analyses turned away because the queue was full',
+                       lambda: engine.rejected)
+metrics.counter_callback('skin_result_cache_hits_total', 'Analysis result cache hits',
+                       lambda: result_cache.stats()['hits'])
+metrics.counter_callback('skin_result_cache_misses_total', 'Analysis result cache misses',
+                       lambda: result_cache.stats()['misses'])
+metrics.counter_callback('skin_user_cache_hits_total', 'User loader cache hits',
+                         lambda: identity_cache.hits)
+metrics.counter_callback('skin_user_cache_misses_total', 'User loader cache misses',
+                         lambda: identity_cache.misses)
+metrics.counter_callback('skin_page_cache_hits_total', 'Rendered page cache hits',
+                         lambda: page_cache.hits)
+metrics.counter_callback('skin_page_cache_misses_total', 'Rendered page cache misses',
+                         lambda: page_cache.misses)
+
+def services(app=None):
+    """The analysis services of an app, the current app by default (see init_services)"""
+    return (app or current_app).extensions['analysis_services']
+
+def _service(name):
+    return LocalProxy(lambda: getattr(services(), name))
+
+# Analysis services of the current app; each app created by create_app()
+# keeps its own in app.extensions, so a second app never rebinds them
+result_cache = _service('result_cache')
+engine = _service('engine')
+job_runner = _service('job_runner')
+history_writer = _service('history_writer')
+asset_store = _service('asset_store')
+blob_store = _service('blob_store')
+upload_collector = _service('upload_collector')
+similarity_index = _service('similarity_index')
 
 # User Model
 class User(UserMixin, db.Model):
@@ -63,184 +245,430 @@ class User(UserMixin, db.Model):
 class AnalysisHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # '<sha256>_<original name>' for uploads in the blob store (older rows: '<uuid>_<name>')
     filename = db.Column(db.String(255), nullable=False)
+    # Digest of the stored original, counted as a reference by the upload GC
+    blob = db.Column(db.String(64), index=True)
     risk_level = db.Column(db.String(50), nullable=False)
     risk_score = db.Column(db.Integer, nullable=False)
     analysis_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Packed feature vector (analysis.pack_features) so rows can be re-scored without the image
+    features = db.Column(db.LargeBinary)
+    # Perceptual hash of the image (analysis.perceptual_hash) for finding the same lesion again
+    phash = db.Column(db.String(16))
     
     user = db.relationship('User', backref=db.backref('analyses', lazy=True))
+    
+    # Serve the per-user history pages and counts, and the rows the similarity
+    # index has not loaded yet, without scanning the table
+    __table_args__ = (db.Index('ix_analysis_history_user_date', 'user_id', 'analysis_date'),
+                      db.Index('ix_analysis_history_user_id_id', 'user_id', 'id'))
+
+# Asynchronous Analysis Job Model
+# Counters shared by every server process, bumped when cached derived data goes stale
+class Generation(db.Model):
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class AnalysisJob(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)
+    blob = db.Column(db.String(64))
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        data = {
+            'success': True,
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+        if self.status == 'done':
+            data['result'] = json.loads(self.result)
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+def upgrade_schema():
+    """Add columns and indexes that create_all() does not add to existing tables"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def note_changed_user(mapper, connection, target):
+    """Remember a user whose row changed, to be dropped from the cache on commit"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def forget_changed_users(session):
+    """Drop the cached snapshots of users changed by the committed transaction
+
+    Flushes run before the commit, so invalidating there would let another
+    request cache the old row again until the TTL ran out.
+    """
+    for user_id in session.info.pop('changed_users', ()):
+        identity_cache.invalidate(user_id)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Forms
-class LoginForm(FlaskForm):
-    username = StringField('Username', validators=[InputRequired(), Length(min=4, max=20)])
-    password = PasswordField('Password', validators=[InputRequired(), Length(min=6, max=20)])
-    submit = SubmitField('Sign In')
-
-class RegisterForm(FlaskForm):
-    email = EmailField('Email', validators=[InputRequired(), Email()])
-    username = StringField('Username', validators=[InputRequired(), Length(min=4, max=20)])
-    password = PasswordField('Password', validators=[InputRequired(), Length(min=6, max=20)])
-    confirm_password = PasswordField('Confirm Password', 
-                                   validators=[InputRequired(), 
-                                             EqualTo('password', message='Passwords must match')])
-    submit = SubmitField('Sign Up')
+    user_id = int(user_id)
+    snapshot = identity_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            identity_cache.put(user_id, {column.key: getattr(user, column.key)
+                                         for column in User.__table__.columns})
+        return user
+    # Attach a copy rebuilt from the snapshot to this session without a SELECT
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 def allowed_file(filename):
     """Check if uploaded file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_image_analysis(image_path):
-    """Analyze skin lesion image using PIL"""
+def check_upload(file):
+    """Validate an upload's magic bytes and pixel dimensions before it is saved or decoded"""
+    return validate_upload(file, current_app.config['MAX_IMAGE_PIXELS'],
+                           current_app.config['MAX_TIFF_PIXELS'])
+
+def upload_name(digest, original_name):
+    """Stored name of an upload: its blob digest, then the original file name"""
+    return f"{digest}_{secure_filename(original_name)}"
+
+def upload_source(filename):
+    """(rendition key, path of the original) of a stored upload name
+
+    Uploads in the blob store share renditions by digest; older uploads
+    live directly in the upload folder under their own name.
+    """
+    digest = filename.split('_', 1)[0]
+    if is_digest(digest):
+        return blob_store.key(digest), blob_store.path(digest)
+    return filename, os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+def make_renditions(source, filename):
+    """Create the thumbnail and preview of a kept upload; media() retries lazily on failure"""
+    key, _ = upload_source(filename)
+    folder = current_app.config['UPLOAD_FOLDER']
+    if has_renditions(folder, key):
+        # The same image was uploaded before
+        return
     try:
-        # Load image with PIL
-        original_image = Image.open(image_path)
-        
-        # Convert to RGB if necessary
-        if original_image.mode != 'RGB':
-            rgb_image = original_image.convert('RGB')
-        else:
-            rgb_image = original_image.copy()
-        
-        # Image processing using PIL
-        
-        # 1. Enhance contrast
-        enhancer = ImageEnhance.Contrast(rgb_image)
-        contrast_enhanced = enhancer.enhance(1.2)
-        
-        # 2. Apply Gaussian blur for noise reduction
-        blurred = contrast_enhanced.filter(ImageFilter.GaussianBlur(radius=1))
-        
-        # 3. Convert to numpy array for analysis
-        img_array = np.array(blurred)
-        
-        # 4. Basic color analysis
-        avg_color = np.mean(img_array, axis=(0, 1))
-        color_std = np.std(img_array, axis=(0, 1))
-        
-        # 5. Asymmetry detection
-        height, width = img_array.shape[:2]
-        left_half = img_array[:, :width//2]
-        right_half = np.fliplr(img_array[:, width//2:])
-        
-        # Resize halves to same size for comparison
-        if left_half.shape[1] != right_half.shape[1]:
-            min_width = min(left_half.shape[1], right_half.shape[1])
-            left_half = left_half[:, :min_width]
-            right_half = right_half[:, :min_width]
-        
-        asymmetry_score = np.mean(np.abs(left_half.astype(float) - right_half.astype(float)))
-        
-        # 6. Color variation analysis
-        color_variation = np.mean(color_std)
-        
-        # 7. Edge detection for border irregularity
-        gray = rgb_image.convert('L')
-        edges = gray.filter(ImageFilter.FIND_EDGES)
-        edge_array = np.array(edges)
-        border_irregularity = np.std(edge_array)
-        
-        # Calculate risk score
-        risk_assessment = calculate_risk_score({
-            'asymmetry_score': asymmetry_score,
-            'color_variation': color_variation,
-            'border_irregularity': border_irregularity
-        })
-        
-        return {
-            'success': True,
-            'image_size': rgb_image.size,
-            'avg_color': avg_color.tolist(),
-            'color_variation': float(color_variation),
-            'asymmetry_score': float(asymmetry_score),
-            'border_irregularity': float(border_irregularity),
-            'risk_assessment': risk_assessment,
-            'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        
+        generate_renditions(source, folder, key)
     except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
+        current_app.logger.warning('Could not create renditions of %s: %s', filename, e)
+
+def read_job_upload(job):
+    """Bytes a queued job analyzes"""
+    if job.blob:
+        return blob_store.read(job.blob)
+    with open(os.path.join(current_app.config['UPLOAD_FOLDER'], job.filename), 'rb') as f:
+        return f.read()
+
+def upload_references():
+    """Reference count and newest use (Unix time) of every stored blob
+
+    Analyses in the history count, and so do jobs that have not run yet.
+    """
+    references = {}
+    rows = (db.session.query(AnalysisHistory.blob, func.count(AnalysisHistory.id),
+                             func.max(AnalysisHistory.analysis_date))
+            .filter(AnalysisHistory.blob.isnot(None))
+            .group_by(AnalysisHistory.blob))
+    for digest, count, last_used in rows:
+        references[digest] = (count, last_used.replace(tzinfo=timezone.utc).timestamp())
+    jobs = (db.session.query(AnalysisJob.blob, AnalysisJob.created_at)
+            .filter(AnalysisJob.blob.isnot(None), AnalysisJob.status.in_(('pending', 'running'))))
+    for digest, created_at in jobs:
+        count, _ = references.get(digest, (0, None))
+        # A queued job is always recent enough to keep its upload
+        references[digest] = (count + 1, None)
+    return references
+
+def sweep_legacy_uploads(grace, retention=None, dry_run=False):
+    """Delete files stored before the blob store that no analysis or job uses
+
+    Returns (files removed, bytes reclaimed).
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    used = {name for name, in db.session.query(AnalysisHistory.filename)
+            .filter(AnalysisHistory.blob.is_(None))}
+    used.update(name for name, in db.session.query(AnalysisJob.filename)
+                .filter(AnalysisJob.blob.is_(None), AnalysisJob.status.in_(('pending', 'running'))))
+    now = time.time()
+    removed = reclaimed = 0
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return removed, reclaimed
+    for entry in entries:
+        if not entry.is_file(follow_symlinks=False) or entry.name.endswith('.tmp'):
+            continue
+        age = now - entry.stat().st_mtime
+        if entry.name in used:
+            if retention is None or age <= retention:
+                continue
+        elif age <= grace:
+            continue
+        removed += 1
+        reclaimed += entry.stat().st_size
+        if not dry_run:
+            os.remove(entry.path)
+            remove_renditions(folder, entry.name)
+    return removed, reclaimed
+
+def hashed_rows(user_id, after_id):
+    """(id, perceptual hash) of a user's analyses after the given id, for the similarity index"""
+    return (db.session.query(AnalysisHistory.id, AnalysisHistory.phash)
+            .filter(AnalysisHistory.user_id == user_id, AnalysisHistory.id > after_id,
+                    AnalysisHistory.phash.isnot(None))
+            .order_by(AnalysisHistory.id)
+            .all())
+
+def hash_generation():
+    """Generation of the stored perceptual hashes; backfill-hashes bumps it"""
+    return db.session.query(Generation.value).filter_by(name='phash').scalar() or 0
+
+def bump_hash_generation():
+    """Make every process rebuild its similarity indexes on their next query"""
+    updated = db.session.execute(update(Generation).where(Generation.name == 'phash')
+                                 .values(value=Generation.value + 1)).rowcount
+    if not updated:
+        db.session.add(Generation(name='phash', value=1))
+    db.session.commit()
+
+def similar_analyses(user_id, result):
+    """The user's earlier analyses that look like the same lesion, nearest first,
+    with how much each feature has changed since"""
+    from analysis import FEATURE_FIELDS, pack_features, unpack_features
+
+    if not result.get('phash'):
+        return []
+    matches = similarity_index.search(user_id, result['phash'],
+                                      radius=current_app.config['SIMILAR_MAX_DISTANCE'],
+                                      limit=current_app.config['SIMILAR_LIMIT'])
+    if not matches:
+        return []
+    rows = {row.id: row for row in
+            AnalysisHistory.query.filter(AnalysisHistory.id.in_([i for _, i in matches]))}
+    current = unpack_features([pack_features(result)])[0]
+    similar = []
+    for distance, analysis_id in matches:
+        row = rows.get(analysis_id)
+        if row is None:
+            continue
+        entry = {
+            'id': row.id,
+            'filename': row.filename,
+            'analysis_date': row.analysis_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'risk_level': row.risk_level,
+            'risk_score': row.risk_score,
+            'distance': distance,
+            'similarity': 1 - distance / 64,
+            'changes': None
         }
+        if row.features is not None:
+            previous = unpack_features([row.features])[0]
+            entry['changes'] = {field: float(delta) for field, delta in zip(FEATURE_FIELDS, current - previous)}
+        similar.append(entry)
+    return similar
 
-def calculate_risk_score(analysis_data):
-    """Calculate risk score based on image analysis"""
-    score = 0
-    risk_factors = []
-    
-    # Asymmetry check
-    if analysis_data['asymmetry_score'] > 50:
-        score += 3
-        risk_factors.append("High asymmetry detected")
-    elif analysis_data['asymmetry_score'] > 30:
-        score += 1
-        risk_factors.append("Moderate asymmetry")
-    
-    # Color variation check
-    if analysis_data['color_variation'] > 40:
-        score += 2
-        risk_factors.append("Significant color variation")
-    elif analysis_data['color_variation'] > 25:
-        score += 1
-        risk_factors.append("Some color variation")
-    
-    # Border irregularity check
-    if analysis_data['border_irregularity'] > 30:
-        score += 2
-        risk_factors.append("Irregular borders detected")
-    elif analysis_data['border_irregularity'] > 20:
-        score += 1
-        risk_factors.append("Some border irregularity")
-    
-    # Determine risk level
-    if score >= 5:
-        risk_level = "HIGH"
-        recommendation = "Strongly recommend immediate dermatologist consultation"
-        color_class = "danger"
-    elif score >= 3:
-        risk_level = "MODERATE"
-        recommendation = "Consider scheduling dermatologist appointment"
-        color_class = "warning"
-    else:
-        risk_level = "LOW"
-        recommendation = "Continue regular self-examinations"
-        color_class = "success"
-    
-    return {
-        'score': score,
-        'max_score': 7,
-        'level': risk_level,
-        'factors': risk_factors,
-        'recommendation': recommendation,
-        'color_class': color_class
+def add_similar(result):
+    """List the signed-in user's similar earlier analyses with a successful result"""
+    if result['success'] and current_user.is_authenticated:
+        result['similar'] = similar_analyses(current_user.id, result)
+    return result
+
+def collect_uploads(dry_run=False):
+    """Reclaim stored uploads nothing references any more, or past their retention"""
+    config = current_app.config
+    retention = config['UPLOAD_RETENTION_DAYS'] * 86400 or None
+    folder = config['UPLOAD_FOLDER']
+    stats = collect_garbage(blob_store, upload_references(), grace=config['UPLOAD_GC_GRACE'],
+                            retention=retention, dry_run=dry_run,
+                            on_delete=lambda digest: remove_renditions(folder, blob_store.key(digest)))
+    stats['legacy_removed'], stats['legacy_bytes'] = sweep_legacy_uploads(
+        config['UPLOAD_GC_GRACE'], retention, dry_run)
+    return stats
+
+HISTORY_PAGE_SIZE = 20
+
+def history_page(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a user's analyses, newest first, and the cursor of the next page
+
+    before is the (analysis_date, id) of the last row of the previous
+    page; keyset paging keeps every page an index range scan.
+    """
+    query = AnalysisHistory.query.filter_by(user_id=user_id)
+    if before is not None:
+        date, analysis_id = before
+        query = query.filter(or_(AnalysisHistory.analysis_date < date,
+                                 and_(AnalysisHistory.analysis_date == date,
+                                      AnalysisHistory.id < analysis_id)))
+    rows = (query.order_by(AnalysisHistory.analysis_date.desc(), AnalysisHistory.id.desc())
+            .limit(limit + 1)
+            .all())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1].analysis_date, rows[-1].id)
+    return rows, next_cursor
+
+def risk_counts(user_id):
+    """Number of analyses per risk level (and in total) from one GROUP BY query"""
+    counts = {'HIGH': 0, 'MODERATE': 0, 'LOW': 0}
+    rows = (db.session.query(AnalysisHistory.risk_level, func.count(AnalysisHistory.id))
+            .filter(AnalysisHistory.user_id == user_id)
+            .group_by(AnalysisHistory.risk_level))
+    for level, count in rows:
+        counts[level] = count
+    counts['total'] = sum(counts.values())
+    return counts
+
+def parse_cursor(args):
+    """Read a history cursor from ?before=<iso date>&before_id=<id>, ignoring bad values"""
+    try:
+        return datetime.fromisoformat(args['before']), int(args['before_id'])
+    except (KeyError, ValueError):
+        return None
+
+def analysis_options():
+    """Analysis settings for this request: the configured defaults, which API
+    callers can override with roi=1/0, compare=1 (whole-frame comparison)
+    and backend=<name>"""
+    options = {
+        'max_edge': current_app.config['ANALYSIS_MAX_EDGE'],
+        'roi': current_app.config['ANALYSIS_ROI'],
+        'compare': False,
+        'backend': current_app.config['ANALYSIS_BACKEND']
     }
+    if request.path.startswith('/api/'):
+        for name in ('roi', 'compare'):
+            if name in request.values:
+                options[name] = request.values[name].lower() in ('1', 'true', 'yes', 'on')
+        if request.values.get('backend'):
+            options['backend'] = request.values['backend'].lower()
+    return options
+
+def cache_key(data, options):
+    """Result cache key for uploaded bytes under the given analysis settings
+
+    Every filter backend gives the same features, so the backend is not
+    part of the key.
+    """
+    from analysis import ANALYSIS_VERSION, THRESHOLD_VERSION
+
+    flags = [name for name in ('roi', 'compare') if options[name]]
+    return result_cache.key_for(data, f'{ANALYSIS_VERSION}.{THRESHOLD_VERSION}',
+                                options['max_edge'], *flags)
+
+def cached_result(key):
+    """Look up a cached analysis, stamping it with the current date"""
+    result = result_cache.get(key)
+    if result is not None:
+        result['analysis_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        result['cached'] = True
+    return result
+
+def complete_job(job, result):
+    """Record a finished job like a synchronous upload would"""
+    from analysis import pack_features
+
+    _, filepath = upload_source(job.filename)
+    if result['success'] and job.user_id is not None:
+        # Looked up before this analysis joins the history, so it does not match itself
+        job.result = json.dumps({**result, 'similar': similar_analyses(job.user_id, result)})
+        # Signed-in uploads keep their image and appear in the user's history
+        db.session.add(AnalysisHistory(
+            user_id=job.user_id,
+            filename=job.filename,
+            blob=job.blob,
+            phash=result.get('phash'),
+            risk_level=result['risk_assessment']['level'],
+            risk_score=result['risk_assessment']['score'],
+            features=pack_features(result)
+        ))
+        make_renditions(filepath, job.filename)
+    elif job.blob is None and os.path.exists(filepath):
+        os.remove(filepath)
+    # An unused blob is left to the upload GC: an identical upload may still need it
+
+def analyze_upload(data):
+    """Analyze uploaded bytes, reusing the cached result for identical content"""
+    options = analysis_options()
+    key = cache_key(data, options)
+    result = cached_result(key)
+    if result is None:
+        result = engine.analyze(data, **options)
+        if result['success']:
+            result_cache.put(key, result)
+    return result
+
+def render_cached(template):
+    """Render a page that only depends on the template and the signed-in user,
+    reusing the last rendering and answering If-None-Match with 304
+
+    Pending flash messages are rendered into the page (and consumed), so
+    such requests bypass the cache, as does debug mode.
+    """
+    if current_app.debug or '_flashes' in session:
+        return render_template(template)
+    identity = None
+    if current_user.is_authenticated:
+        # The navigation bar shows the username and email
+        identity = (current_user.id, current_user.username, current_user.email)
+    key = (template, page_cache.version(current_app.jinja_env, template), identity)
+    etag, body = page_cache.get(key) or page_cache.put(key, render_template(template))
+    response = current_app.make_response(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
-@app.route('/')
 def index():
     """Landing page - redirects to login for authentication first"""
     if current_user.is_authenticated:
         return redirect(url_for('welcome'))
     return redirect(url_for('login'))
 
-@app.route('/welcome')
 @login_required
 def welcome():
     """Welcome landing page - shown after successful login"""
-    return render_template('welcome.html')
+    return render_cached('welcome.html')
 
-@app.route('/home')
 @login_required
 def home():
     """Home page for authenticated users"""
     return render_template('index.html')
 
-@app.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page"""
+    from forms import LoginForm
+
     if current_user.is_authenticated:
         return redirect(url_for('home'))
     
@@ -257,9 +685,10 @@ def login():
     
     return render_template('login.html', form=form)
 
-@app.route('/signup', methods=['GET', 'POST'])
 def signup():
     """Registration page"""
+    from forms import RegisterForm
+
     if current_user.is_authenticated:
         return redirect(url_for('home'))
     
@@ -291,23 +720,22 @@ def signup():
     
     return render_template('signup.html', form=form)
 
-@app.route('/logout')
 @login_required
 def logout():
     """Logout user"""
+    identity_cache.invalidate(current_user.id)
     logout_user()
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('login'))
 
-@app.route('/dashboard')
 @login_required
 def dashboard():
     """User dashboard with analysis history"""
-    analyses = AnalysisHistory.query.filter_by(user_id=current_user.id).order_by(AnalysisHistory.analysis_date.desc()).limit(10).all()
-    return render_template('dashboard.html', analyses=analyses)
+    analyses, _ = history_page(current_user.id, limit=10)
+    return render_template('dashboard.html', analyses=analyses, counts=risk_counts(current_user.id))
 
-@app.route('/upload', methods=['POST'])
 @login_required
+@track('upload')
 def upload_file():
     """Handle file upload and analysis"""
     if 'file' not in request.files:
@@ -321,54 +749,68 @@ def upload_file():
         return redirect(url_for('home'))
     
     if file and allowed_file(file.filename):
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
+        from analysis import pack_features
+
         try:
-            # Save uploaded file
-            file.save(filepath)
+            check_upload(file)
             
-            # Analyze the image
-            analysis_result = process_image_analysis(filepath)
+            with stage('upload', 'read'):
+                data = file.read()
+            
+            # Analyze the image (identical re-uploads come from the cache)
+            with stage('upload', 'analysis'):
+                analysis_result = analyze_upload(data)
             
             if analysis_result['success']:
-                # Get file info
-                file_size = os.path.getsize(filepath) / 1024  # KB
+                # Earlier photos of the same lesion, before this one joins the history
+                with stage('upload', 'similar'):
+                    add_similar(analysis_result)
+                
+                # Keep the original in the content-addressed store (stored once per content)
+                with stage('upload', 'save'):
+                    digest = blob_store.put(data)
+                filename = upload_name(digest, file.filename)
+                file_size = len(data) / 1024  # KB
                 
                 # Save analysis to history
-                analysis_history = AnalysisHistory(
-                    user_id=current_user.id,
-                    filename=filename,
-                    risk_level=analysis_result['risk_assessment']['level'],
-                    risk_score=analysis_result['risk_assessment']['score']
-                )
-                db.session.add(analysis_history)
-                db.session.commit()
+                with stage('upload', 'db_commit'):
+                    history_writer.add(
+                        user_id=current_user.id,
+                        filename=filename,
+                        blob=digest,
+                        phash=analysis_result['phash'],
+                        risk_level=analysis_result['risk_assessment']['level'],
+                        risk_score=analysis_result['risk_assessment']['score'],
+                        features=pack_features(analysis_result)
+                    )
+                
+                # Small renditions for the dashboard and results pages
+                with stage('upload', 'thumbnails'):
+                    make_renditions(data, filename)
                 
-                return render_template('results.html', 
-                                     filename=filename,
-                                     file_size=file_size,
-                                     analysis=analysis_result)
+                with stage('upload', 'render'):
+                    return render_template('results.html', 
+                                         filename=filename,
+                                         file_size=file_size,
+                                         analysis=analysis_result)
             else:
+                metrics.inc(REQUEST_ERRORS, endpoint='upload', kind='analysis_failed')
                 flash(f'Analysis failed: {analysis_result["error"]}')
-                # Clean up file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
                 return redirect(url_for('index'))
                 
+        except EngineBusy:
+            raise
+            
         except Exception as e:
+            metrics.inc(REQUEST_ERRORS, endpoint='upload', kind=type(e).__name__)
             flash(f'Upload failed: {str(e)}')
-            # Clean up file if it was saved
-            if os.path.exists(filepath):
-                os.remove(filepath)
             return redirect(url_for('index'))
     
     else:
         flash('Invalid file type. Please upload PNG, JPG, JPEG, GIF, BMP, or TIFF files.')
         return redirect(url_for('index'))
 
-@app.route('/api/analyze', methods=['POST'])
+@track('api_analyze')
 def api_analyze():
     """API endpoint for image analysis"""
     if 'file' not in request.files:
@@ -380,122 +822,540 @@ def api_analyze():
         return jsonify({'success': False, 'error': 'Invalid file'})
     
     try:
-        # Save to temporary location
-        filename = f"temp_{uuid.uuid4()}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Analyze
-        result = process_image_analysis(filepath)
-        
-        # Clean up temporary file
-        os.remove(filepath)
+        check_upload(file)
         
+        # Analyze straight from the in-memory upload
+        with stage('api_analyze', 'read'):
+            data = file.read()
+        with stage('api_analyze', 'analysis'):
+            result = analyze_upload(data)
+        with stage('api_analyze', 'similar'):
+            add_similar(result)
+        if not result['success']:
+            metrics.inc(REQUEST_ERRORS, endpoint='api_analyze', kind='analysis_failed')
         return jsonify(result)
         
+    except EngineBusy:
+        raise
+        
     except Exception as e:
+        metrics.inc(REQUEST_ERRORS, endpoint='api_analyze', kind=type(e).__name__)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/about')
+@track('api_analyze_batch')
+def api_analyze_batch():
+    """API endpoint for analyzing many images in one request"""
+    request.max_content_length = current_app.config['BATCH_MAX_CONTENT_LENGTH']
+    files = request.files.getlist('files') or request.files.getlist('file')
+
+    if not files:
+        return jsonify({'success': False, 'error': 'No files provided'})
+
+    if len(files) > current_app.config['BATCH_MAX_FILES']:
+        return jsonify({'success': False,
+                        'error': f"Too many files (max {current_app.config['BATCH_MAX_FILES']})"})
+
+    # Files are analyzed concurrently, but the batch keeps at most one
+    # analysis per worker in flight so it never fills the engine's queue
+    # itself; EngineBusy then only reflects load from other requests.
+    # A bad file only produces an error entry for itself
+    pending = []
+    running = set()
+    window = max(engine.workers, 1)
+    retry_after = None
+    options = analysis_options()
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            pending.append((file.filename, None, None, {'success': False, 'error': 'Invalid file'}))
+            continue
+        try:
+            check_upload(file)
+            data = file.read()
+            key = cache_key(data, options)
+            cached = cached_result(key)
+            if cached is not None:
+                pending.append((file.filename, None, None, cached))
+                continue
+            while len(running) >= window:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+            future = engine.submit(data, **options)
+            running.add(future)
+            pending.append((file.filename, future, key, None))
+        except EngineBusy as busy:
+            retry_after = busy.retry_after
+            pending.append((file.filename, None, None, {'success': False, 'error': str(busy), 'retry': True}))
+        except Exception as e:
+            pending.append((file.filename, None, None, {'success': False, 'error': str(e)}))
+
+    results = []
+    for filename, future, key, result in pending:
+        if future is not None:
+            try:
+                result = future.result()
+                if result['success']:
+                    result_cache.put(key, result)
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+        results.append({'filename': filename, **add_similar(result)})
+
+    response = jsonify({
+        'success': True,
+        'count': len(results),
+        'results': results
+    })
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@track('api_submit_job')
+def api_submit_job():
+    """Queue an image for background analysis and return its job id"""
+    if 'file' not in request.files:
+        return jsonify({'success': False, 'error': 'No file provided'})
+    
+    file = request.files['file']
+    
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'success': False, 'error': 'Invalid file'})
+    
+    try:
+        check_upload(file)
+    except UploadRejected as e:
+        return jsonify({'success': False, 'error': str(e)})
+    
+    job_id = str(uuid.uuid4())
+    digest = blob_store.put(file.read())
+    
+    job = AnalysisJob(
+        id=job_id,
+        user_id=current_user.id if current_user.is_authenticated else None,
+        filename=upload_name(digest, file.filename),
+        blob=digest
+    )
+    db.session.add(job)
+    db.session.commit()
+    job_runner.notify()
+    
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_job_status', job_id=job_id)
+    return response
+
+def api_job_status(job_id):
+    """Status, and once finished the result, of a background analysis job"""
+    job = db.session.get(AnalysisJob, job_id)
+    user_id = current_user.id if current_user.is_authenticated else None
+    if job is None or (job.user_id is not None and job.user_id != user_id):
+        response = jsonify({'success': False, 'error': 'Job not found'})
+        response.status_code = 404
+        return response
+    
+    # Resume jobs left pending by a previous run of this process
+    if job.status in ('pending', 'running'):
+        job_runner.start()
+    return jsonify(job.to_dict())
+
+def api_cache_stats():
+    """Hit/miss counters of the analysis result cache"""
+    return jsonify(result_cache.stats())
+
+def owns_upload(filename):
+    """Whether one of the signed-in user's analyses is of this upload"""
+    return db.session.query(AnalysisHistory.id).filter_by(
+        user_id=current_user.id, filename=filename).first() is not None
+
+@login_required
+def media(kind, filename):
+    """Thumbnail or preview of one of the user's uploads, cacheable forever
+    by their browser (only) since uploads never change"""
+    if kind not in RENDITIONS or filename != secure_filename(filename):
+        return '', 404
+    if not owns_upload(filename):
+        # With write-behind history the row may still be queued
+        if history_writer.mode != 'async' or not history_writer.flush() or not owns_upload(filename):
+            return '', 404
+    key, original = upload_source(filename)
+    try:
+        path = ensure_rendition(current_app.config['UPLOAD_FOLDER'], kind, key, original)
+    except Exception:
+        path = None
+    if path is None:
+        return '', 404
+    response = send_file(os.path.abspath(path), conditional=True, etag=True, max_age=365 * 24 * 3600)
+    # Medical images: never stored by shared proxies or CDNs
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+def assets_watched():
+    """Whether asset lookups should notice files changed on disk"""
+    return current_app.config['ASSETS_WATCH'] or current_app.debug
+
+def asset_url(filename):
+    """Template helper: the fingerprinted URL of a static file (plain /static URL if it is missing)"""
+    asset = asset_store.get(filename, watch=assets_watched())
+    if asset is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=asset.url_path)
+
+def asset(filename):
+    """Fingerprinted static file in its best accepted encoding, cacheable forever"""
+    found, fresh = asset_store.resolve(filename, watch=assets_watched())
+    if found is None:
+        return '', 404
+    if not fresh:
+        # A page rendered before the file changed: send it to the current version
+        return redirect(url_for('asset', filename=found.url_path))
+    encoding, body = found.negotiate(request.accept_encodings)
+    response = current_app.response_class(body, mimetype=found.mimetype)
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    if len(found.variants) > 1:
+        response.vary.add('Accept-Encoding')
+    response.set_etag(f'{found.fingerprint}-{encoding}')
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    if not metrics.enabled:
+        return jsonify({'success': False, 'error': 'Metrics are disabled'}), 404
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 def about():
     """About page"""
-    return render_template('about.html')
+    return render_cached('about.html')
 
-@app.route('/diagnose')
 @login_required
 def diagnose():
     """Diagnose page - main analysis tool"""
     return render_template('index.html')
 
-@app.route('/cancer-types')
 def cancer_types():
     """Cancer Types information page"""
-    return render_template('cancer_types.html')
+    return render_cached('cancer_types.html')
 
-@app.route('/profile')
 @login_required
 def profile():
     """User profile page"""
-    return render_template('profile.html', user=current_user)
+    return render_template('profile.html', user=current_user, counts=risk_counts(current_user.id))
 
-@app.route('/settings')
 @login_required
 def settings():
     """User settings page"""
     return render_template('settings.html')
 
-@app.route('/history')
 @login_required
 def history():
     """User diagnosis history"""
-    analyses = AnalysisHistory.query.filter_by(user_id=current_user.id).order_by(AnalysisHistory.analysis_date.desc()).all()
-    return render_template('history.html', analyses=analyses)
+    before = parse_cursor(request.args)
+    analyses, next_cursor = history_page(current_user.id, before=before)
+    return render_template('history.html',
+                         analyses=analyses,
+                         counts=risk_counts(current_user.id),
+                         next_cursor=next_cursor,
+                         is_first_page=before is None)
+
+@click.command('rescore')
+@with_appcontext
+@click.option('--batch-size', default=10000, show_default=True, help='Rows scored per batch')
+@click.option('--dry-run', is_flag=True, help='Report changes without writing them')
+def rescore_command(batch_size, dry_run):
+    """Re-score stored analyses from their feature vectors after a threshold change"""
+    from analysis import score_feature_matrix, unpack_features
+
+    last_id = 0
+    scanned = changed = 0
+    while True:
+        rows = (db.session.query(AnalysisHistory.id, AnalysisHistory.features,
+                                 AnalysisHistory.risk_score, AnalysisHistory.risk_level)
+                .filter(AnalysisHistory.id > last_id, AnalysisHistory.features.isnot(None))
+                .order_by(AnalysisHistory.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+
+        scores, levels, _ = score_feature_matrix(unpack_features([row.features for row in rows]))
+        updates = [{'id': row.id, 'risk_score': int(score), 'risk_level': str(level)}
+                   for row, score, level in zip(rows, scores, levels)
+                   if row.risk_score != score or row.risk_level != level]
+        changed += len(updates)
+        if updates and not dry_run:
+            # ORM bulk UPDATE by primary key: one executemany per batch
+            db.session.execute(update(AnalysisHistory), updates)
+            db.session.commit()
+        click.echo(f"🔁 {scanned} analyses scanned, {changed} changed")
+
+    skipped = AnalysisHistory.query.filter(AnalysisHistory.features.is_(None)).count()
+    verb = 'would change' if dry_run else 'updated'
+    click.echo(f"✅ Re-scored {scanned} analyses, {verb} {changed}")
+    if skipped:
+        click.echo(f"⚠️  {skipped} older analyses have no stored features and were skipped")
+
+@click.command('backfill-hashes')
+@with_appcontext
+@click.option('--batch-size', default=500, show_default=True, help='Rows hashed per commit')
+@click.option('--all', 'rehash', is_flag=True, help='Rehash analyses that already have a hash too')
+def backfill_hashes_command(batch_size, rehash):
+    """Compute perceptual hashes of stored analyses that predate them"""
+    from analysis import hash_file
+
+    last_id = 0
+    hashed = missing = 0
+    while True:
+        query = AnalysisHistory.query.filter(AnalysisHistory.id > last_id)
+        if not rehash:
+            query = query.filter(AnalysisHistory.phash.is_(None))
+        rows = query.order_by(AnalysisHistory.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            _, path = upload_source(row.filename)
+            try:
+                # The same input the live analysis hashes (see analysis.hash_image)
+                row.phash = hash_file(path)
+                hashed += 1
+            except Exception:
+                missing += 1
+        db.session.commit()
+        click.echo(f"🔁 {hashed} analyses hashed")
+    if hashed:
+        bump_hash_generation()
+    click.echo(f"✅ Hashed {hashed} analyses")
+    if missing:
+        click.echo(f"⚠️  {missing} analyses have no readable image and were skipped")
+
+@click.command('gc-uploads')
+@with_appcontext
+@click.option('--dry-run', is_flag=True, help='Report what would be reclaimed without deleting it')
+def gc_uploads_command(dry_run):
+    """Reclaim stored uploads that no analysis references, or that are past retention"""
+    stats = collect_uploads(dry_run=dry_run)
+    verb = 'would reclaim' if dry_run else 'reclaimed'
+    click.echo(f"📦 {stats['blobs']} stored images ({stats['bytes'] / 1e6:.1f} MB), "
+               f"{stats['referenced']} in use, {stats['shared']} shared by several analyses")
+    click.echo(f"✅ {verb} {stats['unreferenced']} unreferenced and {stats['expired']} expired images "
+               f"({stats['reclaimed_bytes'] / 1e6:.1f} MB)")
+    if stats['legacy_removed']:
+        click.echo(f"🧹 {verb} {stats['legacy_removed']} older upload files "
+                   f"({stats['legacy_bytes'] / 1e6:.1f} MB)")
 
-@app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors"""
     flash('Page not found.')
     return redirect(url_for('index'))
 
-@app.errorhandler(500)
 def internal_server_error(e):
     """Handle 500 errors"""
     flash('An internal server error occurred. Please try again.')
     return redirect(url_for('index'))
 
-@app.errorhandler(413)
 def file_too_large(e):
     """Handle file too large errors"""
     flash('File too large. Please upload a file smaller than 16MB.')
     return redirect(url_for('index'))
 
-def find_free_port(start_port=5000):
-    """Find a free port starting from start_port"""
+def analysis_queue_full(e):
+    """Turn away analyses while the engine queue is full"""
+    if request.path.startswith('/api/'):
+        response = jsonify({'success': False, 'error': str(e), 'retry': True})
+    else:
+        flash('The analysis service is busy. Please try again in a few seconds.')
+        response = current_app.make_response(render_template('index.html'))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def register_views(app):
+    """Attach the routes, error handlers and CLI commands to an app"""
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/welcome', view_func=welcome)
+    app.add_url_rule('/home', view_func=home)
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/signup', view_func=signup, methods=['GET', 'POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.add_url_rule('/dashboard', view_func=dashboard)
+    app.add_url_rule('/upload', view_func=upload_file, methods=['POST'])
+    app.add_url_rule('/api/analyze', view_func=api_analyze, methods=['POST'])
+    app.add_url_rule('/api/analyze/batch', view_func=api_analyze_batch, methods=['POST'])
+    app.add_url_rule('/api/jobs', view_func=api_submit_job, methods=['POST'])
+    app.add_url_rule('/api/jobs/<job_id>', view_func=api_job_status)
+    app.add_url_rule('/api/cache/stats', view_func=api_cache_stats)
+    app.add_url_rule('/media/<kind>/<path:filename>', view_func=media)
+    app.add_url_rule('/assets/<path:filename>', view_func=asset)
+    app.add_url_rule('/metrics', view_func=metrics_endpoint)
+    app.add_url_rule('/about', view_func=about)
+    app.add_url_rule('/diagnose', view_func=diagnose)
+    app.add_url_rule('/cancer-types', view_func=cancer_types)
+    app.add_url_rule('/profile', view_func=profile)
+    app.add_url_rule('/settings', view_func=settings)
+    app.add_url_rule('/history', view_func=history)
+
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(500, internal_server_error)
+    app.register_error_handler(413, file_too_large)
+    app.register_error_handler(EngineBusy, analysis_queue_full)
+
+    app.cli.add_command(rescore_command)
+    app.cli.add_command(gc_uploads_command)
+    app.cli.add_command(backfill_hashes_command)
+    app.add_template_global(asset_url)
+
+def init_services(app):
+    """Create the analysis services from the app configuration, in app.extensions"""
+    # Process pool that runs every analysis off the request thread
+    analysis_engine = AnalysisEngine(workers=app.config['ANALYSIS_WORKERS'],
+                                     queue_size=app.config['ANALYSIS_QUEUE_SIZE'],
+                                     on_timings=record_analysis_timings if metrics.enabled else None)
+
+    app.extensions['analysis_services'] = SimpleNamespace(
+        # Analysis results keyed by content hash + analysis/threshold version (see cache_key)
+        result_cache=ResultCache(app.config['RESULT_CACHE_DB'],
+                                 max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+                                 max_rows=app.config['RESULT_CACHE_DB_ROWS']),
+        engine=analysis_engine,
+        job_runner=JobRunner(app, db, AnalysisJob, analysis_engine, on_complete=complete_job,
+                             read_upload=read_job_upload),
+        history_writer=HistoryWriter(app, db, AnalysisHistory,
+                                     mode=app.config['HISTORY_WRITE_MODE'],
+                                     interval=app.config['HISTORY_WRITE_INTERVAL']),
+        # Fingerprinted, precompressed copies of the static files (see asset_url)
+        asset_store=AssetStore(app.static_folder, PAGE_ASSETS),
+        # Uploaded originals by content hash, and the job that reclaims unused ones
+        blob_store=BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'objects')),
+        upload_collector=UploadCollector(app, collect_uploads, interval=app.config['UPLOAD_GC_INTERVAL'],
+                                         lock_path=os.path.join(app.instance_path, 'upload_gc.lock')),
+        # Per-user in-memory indexes of perceptual hashes for finding earlier photos of a lesion
+        similarity_index=SimilarityIndex(hashed_rows, generation=hash_generation,
+                                         max_users=app.config['SIMILAR_INDEX_USERS'])
+    )
+
+def create_app(config=None):
+    """Build and configure the Flask application
+
+    Only Flask and SQLAlchemy are loaded here; the imaging modules are
+    imported by the first analysis or ahead of time by warmup().
+    """
+    started = time.perf_counter()
+    app = Flask(__name__, template_folder='Template')
+    app.request_class = AnalysisRequest
+    app.config.from_mapping(default_config(app.instance_path))
+    if config:
+        app.config.from_mapping(config)
+    app.secret_key = app.config['SECRET_KEY']
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    with app.app_context():
+        event.listen(db.engine, 'connect', sqlite_pragmas(app.config))
+
+    identity_cache.ttl = app.config['USER_CACHE_TTL']
+    identity_cache.max_entries = app.config['USER_CACHE_SIZE']
+    page_cache.max_entries = app.config['PAGE_CACHE_SIZE']
+    metrics.enabled = app.config['METRICS_ENABLED']
+
+    # Create upload directory if it doesn't exist
+    try:
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    except OSError:
+        # Read-only deployments can still serve the diskless API
+        pass
+
+    init_services(app)
+    register_views(app)
+    STARTUP_SECONDS.set(time.perf_counter() - started, phase='create_app')
+    return app
+
+_warmup_lock = threading.Lock()
+_warmed_up = set()
+
+def warmup(start_engine=True, app=None):
+    """Load the imaging modules and page assets, and optionally the analysis workers,
+    ahead of the first request
+
+    app defaults to the module's app.  Safe to call more than once, and
+    from a background thread: each part runs once per process and app.
+    """
+    started = time.perf_counter()
+    app_services = services(app or globals()['app'])
+    with _warmup_lock:
+        if ('assets', id(app_services)) not in _warmed_up:
+            app_services.asset_store.build()
+            _warmed_up.add(('assets', id(app_services)))
+        if 'imaging' not in _warmed_up:
+            import analysis  # noqa: F401 - imports NumPy and PIL
+            from PIL import Image
+            from thumbnails import output_format
+            from filter_backends import auto_backend
+
+            # Register every PIL image plugin now instead of on the first decode
+            Image.init()
+            output_format()
+            # Benchmark the filter backends now so 'auto' is settled before the first analysis
+            auto_backend()
+            _warmed_up.add('imaging')
+        if start_engine and ('engine', id(app_services), os.getpid()) not in _warmed_up:
+            app_services.engine.warmup()
+            _warmed_up.add(('engine', id(app_services), os.getpid()))
+    STARTUP_SECONDS.set(time.perf_counter() - started, phase='warmup')
+
+def warmup_in_background(start_engine=True, app=None):
+    """Run warmup() without delaying the server from accepting connections"""
+    threading.Thread(target=warmup, args=(start_engine, app), name='warmup', daemon=True).start()
+
+def free_port(preferred=5000, host='127.0.0.1'):
+    """The preferred port if it can be bound right now, otherwise any free port"""
     import socket
-    import subprocess
-    
-    for port in range(start_port, start_port + 100):
+
+    for port in (preferred, 0):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            if sock.connect_ex(('127.0.0.1', port)) != 0:
-                # Port is available
-                return port
+            try:
+                sock.bind((host, port))
+            except OSError:
+                continue
+            return sock.getsockname()[1]
     return None
 
-def kill_existing_flask_processes():
-    """Kill any existing Flask processes to free up ports"""
-    import subprocess
-    try:
-        # Kill any existing Flask processes
-        subprocess.run(['pkill', '-f', 'python.*app.py'], capture_output=True)
-        subprocess.run(['pkill', '-f', 'Flask'], capture_output=True)
-        import time
-        time.sleep(1)
-    except:
-        pass
+def wait_until_listening(port, host='127.0.0.1', timeout=10.0):
+    """Block until something accepts connections on the port, or the timeout passes"""
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
 
-def open_browser(url):
-    """Open the URL in a new browser tab"""
+def open_browser(url, port):
+    """Open the URL in a new browser tab as soon as the server is listening"""
     import webbrowser
-    import threading
-    import time
     
     def delayed_open():
-        time.sleep(1.5)  # Wait for server to start
+        wait_until_listening(port)
         webbrowser.open_new_tab(url)
         print(f"🌐 Opening {url} in your browser...")
     
     # Open browser in a separate thread
     threading.Thread(target=delayed_open, daemon=True).start()
 
+app = create_app()
+STARTUP_SECONDS.set(time.perf_counter() - _IMPORT_STARTED, phase='import')
+
 if __name__ == '__main__':
     print("🏥 Starting Skin Cancer Detection Tool...")
-    print("🧹 Cleaning up any existing processes...")
-    
-    # Kill existing processes
-    kill_existing_flask_processes()
     
     # Find available port
-    port = find_free_port(5000)
+    port = free_port(5000)
     if not port:
         print("❌ Could not find available port")
         exit(1)
@@ -506,8 +1366,18 @@ if __name__ == '__main__':
     # Initialize database
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("✅ Database initialized!")
     
+    # Pick up analysis jobs that were still pending when the server stopped
+    services(app).job_runner.start()
+    
+    # Reclaim unused uploads in the background
+    services(app).upload_collector.start()
+    
+    # Load the imaging modules and analysis workers while the server starts
+    warmup_in_background()
+    
     print("🎨 Enhanced UI Features Loaded:")
     print("  ✨ Advanced animations & effects")
     print("  🌊 Medical particle system")
@@ -518,14 +1388,15 @@ if __name__ == '__main__':
     
     # Open browser automatically
     url = f"http://localhost:{port}"
-    open_browser(url)
+    open_browser(url, port)
     
     print(f"🚀 Server starting on {url}")
     print("🔄 Press Ctrl+C to stop")
+    print("ℹ️  Development server; use serve.py to run in production")
     print("=" * 50)
     
     try:
-        app.run(debug=True, port=port, host='127.0.0.1', use_reloader=False)
+        app.run(debug=app.debug, port=port, host='127.0.0.1', use_reloader=False)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
     except Exception as e:
@@ -0,0 +1,106 @@
+# assets.py - Fingerprinted, precompressed static assets
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: without it assets are offered gzip-compressed only
+    brotli = None
+
+# Text assets are compressed once, at maximum level, when first requested
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.map'}
+MIN_COMPRESS_BYTES = 512
+FINGERPRINT_LENGTH = 12
+
+
+def _compress(data):
+    """Precompressed variants of an asset by Content-Encoding, keeping only those that are smaller"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+class Asset:
+    """One static file: its content fingerprint and every encoding it can be served in"""
+
+    def __init__(self, filename, path):
+        self.filename = filename
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.fingerprint = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        root, ext = os.path.splitext(filename)
+        self.url_path = f'{root}.{self.fingerprint}{ext}'
+        self.variants = {'identity': data}
+        if ext.lower() in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+            self.variants.update(_compress(data))
+
+    def negotiate(self, accept_encodings):
+        """(encoding, body) preferred by the client's Accept-Encoding: br, then gzip, then identity"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings.quality(encoding) > 0:
+                return encoding, self.variants[encoding]
+        return 'identity', self.variants['identity']
+
+
+class AssetStore:
+    """Static files under a root directory, addressed by content-fingerprinted names
+
+    Only the files listed in filenames (the page assets) are served;
+    anything else under the root, uploads included, is never read,
+    compressed or cached, so requests cannot grow the store.  Assets are
+    read, hashed and compressed on first use and kept in memory.  With
+    watch=True (development) a file that changed on disk is picked up
+    again on its next lookup.
+    """
+
+    def __init__(self, root, filenames):
+        self.root = root
+        self.filenames = frozenset(filenames)
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename, watch=False):
+        """The Asset for a path relative to the root, or None if it is not a
+        page asset or there is no such file"""
+        if filename not in self.filenames:
+            return None
+        asset = self._assets.get(filename)
+        if asset is not None and not watch:
+            return asset
+        path = os.path.join(self.root, *filename.split('/'))
+        try:
+            if asset is not None:
+                stat = os.stat(path)
+                if asset.signature == (stat.st_mtime_ns, stat.st_size):
+                    return asset
+            with self._lock:
+                asset = Asset(filename, path)
+                self._assets[filename] = asset
+        except OSError:
+            return None
+        return asset
+
+    def resolve(self, url_path, watch=False):
+        """(asset, fresh) for a fingerprinted path; fresh is False when the
+        fingerprint is not the file's current one"""
+        root, ext = os.path.splitext(url_path)
+        name, _, fingerprint = root.rpartition('.')
+        if not name:
+            return None, False
+        asset = self.get(name + ext, watch=watch)
+        if asset is None:
+            return None, False
+        return asset, asset.fingerprint == fingerprint
+
+    def build(self):
+        """Hash and compress every asset ahead of its first request"""
+        for filename in self.filenames:
+            self.get(filename)
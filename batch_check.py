@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Batch Capacity Check for Skin Cancer Detection Tool
+Sends one full batch (BATCH_MAX_FILES distinct images) to /api/analyze/batch
+on an idle engine with a small worker pool and fails if any file is turned
+away as busy: a batch must never be throttled by its own analyses
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=1, help='analysis processes (ANALYSIS_WORKERS)')
+    parser.add_argument('--queue-size', type=int, default=2, help='engine queue size (ANALYSIS_QUEUE_SIZE)')
+    parser.add_argument('--files', type=int, help='images in the batch (default BATCH_MAX_FILES)')
+    args = parser.parse_args()
+
+    # Configure the engine before the app is created; no persistent cache
+    # tier, so every image is really analyzed
+    os.environ.update({'ANALYSIS_WORKERS': str(args.workers), 'ANALYSIS_QUEUE_SIZE': str(args.queue_size),
+                       'RESULT_CACHE_DB': '', 'UPLOAD_GC_INTERVAL': '0'})
+    from PIL import Image
+    import app as application
+
+    count = args.files or application.app.config['BATCH_MAX_FILES']
+    files = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        # A distinct image per file so none is answered from the result cache
+        Image.new('RGB', (96, 72), (150 + i % 100, 110, 100)).save(buffer, 'PNG')
+        files.append((io.BytesIO(buffer.getvalue()), f'batch_{i}.png'))
+
+    print("📦 Batch capacity check")
+    print("=" * 50)
+    print(f"  {count} files, {args.workers} worker(s), queue size {args.queue_size}")
+    client = application.app.test_client()
+    started = time.perf_counter()
+    response = client.post('/api/analyze/batch', data={'files': files})
+    elapsed = time.perf_counter() - started
+    results = response.get_json()['results']
+    busy = sum(1 for result in results if result.get('retry'))
+    failed = sum(1 for result in results if not result['success'] and not result.get('retry'))
+    print(f"  {len(results)} results in {elapsed:.1f}s: {busy} busy, {failed} failed")
+    application.services(application.app).engine.shutdown()
+
+    print("=" * 50)
+    if busy or failed or len(results) != count:
+        print("❌ The batch was not fully analyzed on an idle engine")
+        sys.exit(1)
+    print("✅ Every file in the batch was analyzed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark Suite for the Analysis Pipeline
+Times process_image_analysis stage by stage on synthetic lesion images and
+records peak memory, so results can be compared between commits
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+DEFAULT_SIZES = [0.3, 2, 12, 40]  # megapixels
+DEFAULT_FORMATS = ['png', 'jpg', 'bmp', 'tiff', 'gif']
+STAGES = ['decode', 'hash', 'convert', 'contrast', 'blur', 'color_stats', 'asymmetry', 'edges', 'scoring']
+
+
+def synthetic_lesion(megapixels, seed=0):
+    """Skin-toned noisy background with a dark, irregular lesion near the centre"""
+    from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+
+    skin = Image.new('RGB', (width, height), (205, 160, 140))
+    noise = Image.effect_noise((width, height), 14).convert('RGB')
+    image = ImageChops.add(skin, noise, offset=-128)
+    del skin, noise
+
+    draw = ImageDraw.Draw(image)
+    cx, cy, radius = width * 0.46, height * 0.5, min(width, height) * 0.2
+    points = []
+    for k in range(48):
+        angle = 2 * math.pi * k / 48
+        r = radius * (1 + 0.25 * math.sin(3 * angle + seed) + 0.08 * math.sin(11 * angle))
+        points.append((cx + r * math.cos(angle), cy + 0.8 * r * math.sin(angle)))
+    draw.polygon(points, fill=(95, 60, 45))
+    draw.ellipse((cx - radius * 0.3, cy - radius * 0.25, cx + radius * 0.1, cy + radius * 0.15),
+                 fill=(45, 28, 22))
+    return image.filter(ImageFilter.GaussianBlur(radius=2))
+
+
+def write_image(image, path, fmt):
+    """Save a synthetic image in one of the supported upload formats"""
+    if fmt == 'jpg':
+        image.save(path, 'JPEG', quality=90)
+    elif fmt == 'gif':
+        image.quantize(colors=256).save(path, 'GIF')
+    else:
+        image.save(path, {'png': 'PNG', 'bmp': 'BMP', 'tiff': 'TIFF'}[fmt])
+
+
+def prepare_images(sizes, formats, workdir):
+    """Generate (or reuse) one image per size and format"""
+    cases = []
+    for megapixels in sizes:
+        image = None
+        for fmt in formats:
+            path = os.path.join(workdir, f'lesion_{megapixels}mp.{fmt}')
+            if not os.path.exists(path):
+                if image is None:
+                    print(f"🎨 Generating {megapixels} MP synthetic lesion...")
+                    image = synthetic_lesion(megapixels)
+                write_image(image, path, fmt)
+            cases.append((megapixels, fmt, path))
+    return cases
+
+
+def _status_kb(field):
+    """Read a memory figure (in kB) from /proc/self/status"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def reset_peak_memory():
+    """Start peak-RSS tracking from now; return the baseline in kB"""
+    try:
+        # Linux resets VmHWM when 5 is written to clear_refs; this also drops
+        # the high-water mark a spawned child inherits from its parent
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status_kb('VmRSS')
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_memory():
+    """Peak RSS in kB since the last reset_peak_memory()"""
+    try:
+        return _status_kb('VmHWM')
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(path, repeat, backend=None):
+    """Benchmark one image in a fresh process so peak memory is attributable to it"""
+    from PIL import Image
+    import analysis
+
+    # Warm up imports and PIL plugins before taking the memory baseline
+    analysis.extract_features(Image.new('RGB', (64, 48)), backend=backend)
+    baseline = reset_peak_memory()
+
+    runs = []
+    for _ in range(repeat):
+        timings = {}
+        started = time.perf_counter()
+        result = analysis.process_image_analysis(path, timings=timings, backend=backend)
+        timings['total'] = time.perf_counter() - started
+        if not result['success']:
+            return {'error': result['error']}
+        runs.append(timings)
+
+    peak_kb = peak_memory() - baseline
+    return {
+        'backend': analysis.get_backend(backend).name,
+        'image_size': list(result['image_size']),
+        'stages': {stage: statistics.median(run.get(stage, 0.0) for run in runs) for stage in STAGES},
+        'total': statistics.median(run['total'] for run in runs),
+        'peak_mb': peak_kb / 1024
+    }
+
+
+def scoring_microbenchmark(number=20000):
+    """Time calculate_risk_score on its own, in microseconds per call"""
+    import analysis
+
+    features = {'asymmetry_score': 35.0, 'color_variation': 27.5, 'border_irregularity': 22.0}
+    seconds = min(timeit.repeat(lambda: analysis.calculate_risk_score(features), number=number, repeat=5))
+    return seconds / number * 1e6
+
+
+def environment():
+    """Describe the machine and code version the numbers were taken on"""
+    import numpy
+    import PIL
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(current, previous_path, threshold):
+    """Print per-case total time change against an earlier run; return regressions"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    before = {(r['megapixels'], r['format']): r for r in previous['results'] if 'total' in r}
+
+    print(f"\n📈 Compared with {previous_path} ({previous['environment'].get('commit')})")
+    regressions = []
+    for result in current['results']:
+        old = before.get((result['megapixels'], result['format']))
+        if old is None or 'total' not in result:
+            continue
+        change = result['total'] / old['total'] - 1
+        memory = result['peak_mb'] - old['peak_mb']
+        flag = ''
+        if change > threshold:
+            flag = ' ⚠️ regression'
+            regressions.append(result)
+        print(f"  {result['megapixels']:>5} MP {result['format']:<5} time {change:+7.1%}  "
+              f"peak {memory:+8.1f} MB{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help='image sizes in megapixels (default: 0.3 2 12 40)')
+    parser.add_argument('--formats', nargs='+', default=DEFAULT_FORMATS, choices=DEFAULT_FORMATS)
+    parser.add_argument('--backend', default='auto',
+                        help="filter backend: pil, numpy or auto (default: auto)")
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, median is reported')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'skin-cancer-bench'),
+                        help='where synthetic images are generated and cached')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown reported as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    cases = prepare_images(args.sizes, args.formats, args.workdir)
+
+    print(f"⏱️  Benchmarking process_image_analysis ({args.backend} backend)")
+    print("=" * 96)
+    header = ''.join(f'{stage[:9]:>10}' for stage in STAGES)
+    print(f"{'case':<14}{header}{'total':>10}{'peak MB':>10}")
+
+    results = []
+    # One fresh process per case keeps the peak-memory numbers independent
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'),
+                             max_tasks_per_child=1) as pool:
+        for megapixels, fmt, path in cases:
+            outcome = pool.submit(run_case, path, args.repeat, args.backend).result()
+            outcome.update({'megapixels': megapixels, 'format': fmt,
+                            'file_bytes': os.path.getsize(path)})
+            results.append(outcome)
+
+            label = f"{megapixels} MP {fmt}"
+            if 'error' in outcome:
+                print(f"{label:<14}❌ {outcome['error']}")
+                continue
+            cells = ''.join(f"{outcome['stages'][stage] * 1000:>8.1f}ms" for stage in STAGES)
+            print(f"{label:<14}{cells}{outcome['total'] * 1000:>8.1f}ms{outcome['peak_mb']:>10.1f}")
+
+    scoring_us = scoring_microbenchmark()
+    print("=" * 96)
+    print(f"🧮 calculate_risk_score: {scoring_us:.2f} µs per call")
+
+    report = {'environment': environment(), 'backend': args.backend, 'results': results,
+              'scoring_us': scoring_us}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
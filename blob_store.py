@@ -0,0 +1,200 @@
+# blob_store.py - Content-addressed storage of uploaded originals
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: collections are not serialized between processes
+    fcntl = None
+
+DIGEST_LENGTH = 64  # hex SHA-256
+SHARD_WIDTH = 2  # hex characters per directory level
+SHARD_DEPTH = 2  # objects/ab/cd/abcd... keeps every directory small
+
+
+def is_digest(value):
+    """Whether a string is a blob digest"""
+    return len(value) == DIGEST_LENGTH and all(c in '0123456789abcdef' for c in value)
+
+
+class BlobStore:
+    """Uploaded images stored once per content hash in sharded directories
+
+    Identical uploads, from any user, share one file.  Blobs carry no
+    reference count of their own: the analyses and jobs that use them are
+    counted from the database when garbage is collected (see
+    collect_garbage), so a crash can never leave a count out of step.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def key(self, digest):
+        """Relative, '/'-separated location of a blob, e.g. 'ab/cd/abcd...'"""
+        shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+        return '/'.join(shards + [digest])
+
+    def path(self, digest):
+        return os.path.join(self.root, *self.key(digest).split('/'))
+
+    def put(self, data):
+        """Store bytes and return their digest; identical content is stored once
+
+        Storing content that already exists refreshes its modification
+        time, which protects it from collection for another grace period.
+        """
+        digest = self.digest(data)
+        path = self.path(digest)
+        try:
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def delete(self, digest):
+        """Remove a blob; returns its size, or 0 if it was already gone"""
+        path = self.path(digest)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        # Drop shard directories left empty
+        for _ in range(SHARD_DEPTH):
+            path = os.path.dirname(path)
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+        return size
+
+    def scan(self):
+        """Yield (digest, modification time, size) of every stored blob"""
+        def walk(directory, depth):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                return
+            for entry in entries:
+                if depth < SHARD_DEPTH:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path, depth + 1)
+                elif entry.is_file(follow_symlinks=False) and is_digest(entry.name):
+                    stat = entry.stat()
+                    yield entry.name, stat.st_mtime, stat.st_size
+
+        yield from walk(self.root, 0)
+
+
+def collect_garbage(store, references, grace=3600, retention=None, dry_run=False,
+                    on_delete=None, now=None):
+    """Delete blobs that nothing references, or whose last use has expired
+
+    references maps digest -> (reference count, time of the newest
+    reference as a Unix timestamp).  Unreferenced blobs younger than
+    grace seconds are kept, since their analysis may not be recorded yet;
+    with retention (seconds) set, referenced blobs whose newest
+    reference is older than that are deleted too.  on_delete(digest) is
+    called for each deleted blob.  Returns counters for reporting.
+    """
+    now = time.time() if now is None else now
+    stats = {'blobs': 0, 'bytes': 0, 'referenced': 0, 'shared': 0,
+             'unreferenced': 0, 'expired': 0, 'reclaimed_bytes': 0}
+    for digest, mtime, size in store.scan():
+        stats['blobs'] += 1
+        stats['bytes'] += size
+        count, last_used = references.get(digest, (0, None))
+        if count:
+            stats['referenced'] += 1
+            stats['shared'] += count > 1
+            if retention is None or last_used is None or now - last_used <= retention:
+                continue
+            stats['expired'] += 1
+        else:
+            if now - mtime <= grace:
+                continue
+            stats['unreferenced'] += 1
+        if dry_run:
+            stats['reclaimed_bytes'] += size
+            continue
+        # Uploaded again since the scan started: keep it
+        if not count and now - os.path.getmtime(store.path(digest)) <= grace:
+            stats['unreferenced'] -= 1
+            continue
+        stats['reclaimed_bytes'] += store.delete(digest)
+        if on_delete is not None:
+            on_delete(digest)
+    return stats
+
+
+class UploadCollector:
+    """Background thread that runs an upload collection every interval seconds
+
+    collect is called inside an app context.  When several server
+    processes share the storage, a lock file lets only one of them
+    collect at a time; the others skip that round.
+    """
+
+    def __init__(self, app, collect, interval=3600, lock_path=None):
+        self.app = app
+        self.collect = collect
+        self.interval = interval
+        self.lock_path = lock_path
+        self._thread = None
+        self._pid = None
+        self.runs = 0
+        self.last_stats = None
+
+    def start(self):
+        """Start the collector thread once per process (and again after a fork)"""
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='upload-gc', daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        """Collect now unless another process is collecting; returns its stats or None"""
+        lock = None
+        if fcntl is not None and self.lock_path:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                return None
+        try:
+            with self.app.app_context():
+                self.last_stats = self.collect()
+            self.runs += 1
+            return self.last_stats
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.app.logger.exception('Upload collection failed: %s', e)
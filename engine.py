@@ -0,0 +1,209 @@
+# engine.py - Process-pool analysis engine with bounded queue and backpressure
+import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+
+class EngineBusy(Exception):
+    """Raised when the analysis queue is full and the request should be retried later"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Analysis queue is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+def _analyze_shared(name, size, max_edge, collect_timings, roi=False, compare=False, backend=None):
+    """Worker entry point: analyze an upload handed over through shared memory"""
+    import analysis  # preloaded by the forkserver
+
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # The upload is read directly from the shared block; only the
+        # (small) result dict is pickled back to the parent
+        view = block.buf[:size]
+        try:
+            stream = io.BytesIO(view)
+        finally:
+            view.release()
+        timings = {} if collect_timings else None
+        result = analysis.process_image_analysis(stream, max_edge=max_edge, timings=timings,
+                                                 roi=roi, compare=compare, backend=backend)
+        return result, timings
+    finally:
+        block.close()
+
+
+def _ready():
+    """Worker entry point used by warmup(): the analysis modules are already loaded"""
+    import analysis  # noqa: F401
+
+    return os.getpid()
+
+
+def _pool_context():
+    """Start workers from a clean forkserver that has only the analysis module loaded"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['analysis'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class AnalysisEngine:
+    """Runs image analysis on a process pool behind a bounded submission queue
+
+    At most workers + queue_size analyses are accepted at once; further
+    submissions raise EngineBusy with a Retry-After estimate instead of
+    queueing without limit.  With workers=0 analyses run inline in the
+    calling thread (useful for development and debugging).  If on_timings
+    is given it receives the per-stage timings of every finished analysis.
+    """
+
+    def __init__(self, workers=None, queue_size=None, on_timings=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        if queue_size is None:
+            queue_size = 4 * max(self.workers, 1)
+        self.capacity = max(self.workers, 1) + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0
+        self.on_timings = on_timings
+
+    def _get_pool(self):
+        """Create the worker pool lazily, and again after a fork or a worker crash"""
+        with self._lock:
+            broken = self._pool is not None and getattr(self._pool, '_broken', False)
+            if self._pool is None or broken or self._pid != os.getpid():
+                if broken:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=_pool_context())
+                self._pid = os.getpid()
+            return self._pool
+
+    def warmup(self):
+        """Start every worker process now so the first analyses do not wait for them"""
+        if self.workers == 0:
+            import analysis  # noqa: F401
+            return
+        pool = self._get_pool()
+        for future in [pool.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, based on recent analysis times"""
+        backlog = self.in_flight / max(self.workers, 1)
+        return max(1, math.ceil(self.avg_seconds * backlog))
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise EngineBusy(self.retry_after())
+        with self._lock:
+            self.in_flight += 1
+
+    def _release(self, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            # Exponentially weighted average of recent analysis times
+            self.avg_seconds += 0.2 * (elapsed - self.avg_seconds)
+        self._slots.release()
+
+    def submit(self, data, max_edge=None, roi=False, compare=False, backend=None):
+        """Queue uploaded bytes for analysis and return a Future of the result dict
+
+        An 'auto' backend is resolved here, once per process, so the
+        workers do not each benchmark the host.
+        """
+        from filter_backends import get_backend
+
+        backend = get_backend(backend).name
+        self._acquire()
+        started = time.perf_counter()
+        collect_timings = self.on_timings is not None
+        future = Future()
+
+        def deliver(outcome):
+            result, timings = outcome
+            if timings:
+                self.on_timings(timings)
+            future.set_result(result)
+
+        if self.workers == 0:
+            import analysis
+
+            timings = {} if collect_timings else None
+            try:
+                result = analysis.analyze_image_bytes(data, max_edge=max_edge, timings=timings,
+                                                      roi=roi, compare=compare, backend=backend)
+            finally:
+                self._release(started)
+            deliver((result, timings))
+            return future
+
+        block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        block.buf[:len(data)] = data
+
+        def cleanup():
+            block.close()
+            block.unlink()
+            self._release(started)
+
+        def finished(worker_future):
+            # The caller's future resolves only after the slot is released
+            cleanup()
+            try:
+                deliver(worker_future.result())
+            except BaseException as e:
+                future.set_exception(e)
+
+        try:
+            worker_future = self._get_pool().submit(_analyze_shared, block.name, len(data),
+                                                    max_edge, collect_timings, roi, compare, backend)
+        except Exception:
+            cleanup()
+            raise
+        worker_future.add_done_callback(finished)
+        return future
+
+    def analyze(self, data, max_edge=None, roi=False, compare=False, backend=None):
+        """Analyze uploaded bytes on the pool and wait for the result dict"""
+        future = self.submit(data, max_edge=max_edge, roi=roi, compare=compare, backend=backend)
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            return {'success': False, 'error': f'Analysis worker crashed: {e}'}
+
+    def stats(self):
+        """Queue depth and throughput counters"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_seconds': self.avg_seconds
+            }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        # Done callbacks take the lock, so wait for the workers outside it
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=True)
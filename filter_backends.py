@@ -0,0 +1,205 @@
+# filter_backends.py - Interchangeable implementations of the analysis image filters
+import functools
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Backends by name; 'auto' (or None) picks the fastest one on this host
+BACKENDS = {}
+
+BENCHMARK_SIZE = (768, 256)  # one full-width band of a typical upload
+BENCHMARK_REPEAT = 5
+
+
+def register(cls):
+    """Class decorator adding a backend to BACKENDS under its name"""
+    BACKENDS[cls.name] = cls()
+    return cls
+
+
+@register
+class PilBackend:
+    """The filters as PIL implements them; frames are PIL images"""
+
+    name = 'pil'
+
+    def load(self, image):
+        return image
+
+    def crop(self, frame, box):
+        return frame.crop(box)
+
+    def contrast(self, frame, lut):
+        return frame.point(lut * len(frame.getbands()))
+
+    def blur(self, frame, radius):
+        return frame.filter(ImageFilter.GaussianBlur(radius=radius))
+
+    def edges(self, frame):
+        return frame.filter(ImageFilter.FIND_EDGES)
+
+    def histogram(self, frame):
+        return frame.histogram()
+
+    def pixels(self, frame):
+        return np.asarray(frame)
+
+
+def _box_radius(radius, passes=3):
+    """Box radius whose repeated box blur approximates a Gaussian, computed in
+    float32 exactly as PIL's GaussianBlur does"""
+    f = np.float32
+    sigma2 = f(radius) * f(radius) / f(passes)
+    length = np.sqrt(f(12) * sigma2 + f(1))
+    whole = np.floor((length - f(1)) / f(2))
+    fraction = (f(2) * whole + f(1)) * (whole * (whole + f(1)) - f(3) * sigma2)
+    fraction /= f(6) * (sigma2 - (whole + f(1)) * (whole + f(1)))
+    return f(whole + fraction)
+
+
+def _box_pass(values, radius, axis, out, scratch):
+    """One box-blur pass along an axis with PIL's 8.24 fixed-point weights
+
+    The window covers int(radius) pixels on each side at full weight and
+    the next pixel on each side at the fractional weight; edges repeat the
+    border pixel.  values, out and scratch are uint32 arrays of one shape,
+    and values stay within 0-255 from pass to pass as PIL rounds them.
+    """
+    whole = int(radius)
+    inner = np.uint32(np.float32(1 << 24) / (radius * np.float32(2) + np.float32(1)))
+    outer = np.uint32(((1 << 24) - (2 * whole + 1) * int(inner)) // 2)
+    values, out, scratch = (np.moveaxis(a, axis, 0) for a in (values, out, scratch))
+    length = values.shape[0]
+
+    if whole:
+        padded = values[np.clip(np.arange(-whole - 1, length + whole + 1), 0, length - 1)]
+        sums = np.zeros((padded.shape[0] + 1,) + padded.shape[1:], dtype=np.uint32)
+        np.cumsum(padded, axis=0, out=sums[1:])
+        span = 2 * whole + 1
+        np.subtract(sums[1 + span:1 + span + length], sums[1:length + 1], out=out)
+        np.add(padded[:length], padded[span + 1:], out=scratch)
+    else:
+        # Radius below one (the analysis blur): a 3-tap kernel, no running sum needed
+        out[...] = values
+        np.add(values[:-2], values[2:], out=scratch[1:-1])
+        np.add(values[0], values[min(1, length - 1)], out=scratch[0])
+        np.add(values[-1], values[max(length - 2, 0)], out=scratch[-1])
+    out *= inner
+    scratch *= outer
+    out += scratch
+    out += np.uint32(1 << 23)
+    out >>= np.uint32(24)
+
+
+@register
+class NumpyBackend:
+    """The same filters as separable NumPy kernels over uint8 arrays
+
+    Blur passes accumulate in uint32 with PIL's fixed-point weights and
+    rounding, and the edge kernel is summed in int16, so the output is
+    identical to PilBackend pixel for pixel.
+    """
+
+    name = 'numpy'
+
+    def load(self, image):
+        return np.asarray(image)
+
+    def crop(self, frame, box):
+        left, top, right, bottom = box
+        return frame[top:bottom, left:right]
+
+    def contrast(self, frame, lut):
+        return np.asarray(lut, dtype=np.uint8)[frame]
+
+    def blur(self, frame, radius):
+        radius = _box_radius(radius)
+        values = frame.astype(np.uint32)
+        out = np.empty_like(values)
+        scratch = np.empty_like(values)
+        # Three horizontal passes, then three vertical ones, like ImagingBoxBlur
+        for axis in (1, 1, 1, 0, 0, 0):
+            _box_pass(values, radius, axis, out, scratch)
+            values, out = out, values
+        return values.astype(np.uint8)
+
+    def edges(self, frame):
+        # 8 x centre minus the 8 neighbours, clipped; PIL leaves the outermost
+        # rows and columns unfiltered
+        out = frame.copy()
+        if min(frame.shape[:2]) < 3:
+            return out
+        values = frame.astype(np.int16)
+        centre = values[1:-1, 1:-1] * 9
+        for dy in range(3):
+            for dx in range(3):
+                centre -= values[dy:dy + values.shape[0] - 2, dx:dx + values.shape[1] - 2]
+        np.clip(centre, 0, 255, out=centre)
+        out[1:-1, 1:-1] = centre
+        return out
+
+    def histogram(self, frame):
+        if frame.ndim == 2:
+            return np.bincount(frame.ravel(), minlength=256)
+        bands = frame.shape[2]
+        return np.concatenate([np.bincount(frame[..., band].ravel(), minlength=256)
+                               for band in range(bands)])
+
+    def pixels(self, frame):
+        return frame
+
+
+def get_backend(name=None):
+    """The backend registered under name, or the host's fastest for None/'auto'"""
+    if name in (None, '', 'auto'):
+        return BACKENDS[auto_backend()]
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown analysis backend '{name}' "
+                         f"(choose from auto, {', '.join(BACKENDS)})") from None
+
+
+def _workload(backend, rgb, gray, lut):
+    """The filter calls extract_features makes for one band; returns its outputs"""
+    band = backend.blur(backend.contrast(backend.load(rgb), lut), 1)
+    edges = backend.edges(backend.load(gray))
+    return (np.asarray(backend.histogram(band)), np.asarray(backend.pixels(band)),
+            np.asarray(backend.histogram(edges)))
+
+
+def benchmark_backends(repeat=BENCHMARK_REPEAT):
+    """Best-of-repeat seconds per backend for one synthetic band
+
+    Backends whose output differs from the PIL reference are reported as
+    None so they are never picked.
+    """
+    rng = np.random.default_rng(0)
+    width, height = BENCHMARK_SIZE
+    rgb = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    gray = rgb.convert('L')
+    lut = np.clip(np.arange(256) * 1.2 - 25, 0, 255).astype(np.uint8).tolist()
+
+    reference = _workload(BACKENDS['pil'], rgb, gray, lut)
+    seconds = {}
+    for name, backend in BACKENDS.items():
+        outputs = _workload(backend, rgb, gray, lut)
+        if not all(np.array_equal(got, want) for got, want in zip(outputs, reference)):
+            seconds[name] = None
+            continue
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _workload(backend, rgb, gray, lut)
+            best = min(best, time.perf_counter() - started)
+        seconds[name] = best
+    return seconds
+
+
+@functools.lru_cache(maxsize=None)
+def auto_backend():
+    """Name of the fastest backend on this host, measured once per process"""
+    seconds = benchmark_backends()
+    timed = {name: value for name, value in seconds.items() if value is not None}
+    return min(timed, key=timed.get)
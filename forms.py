@@ -0,0 +1,18 @@
+# forms.py - Login and registration forms (imported by the views that use them)
+from flask_wtf import FlaskForm
+from wtforms import StringField, PasswordField, EmailField, SubmitField
+from wtforms.validators import InputRequired, Email, Length, EqualTo
+
+class LoginForm(FlaskForm):
+    username = StringField('Username', validators=[InputRequired(), Length(min=4, max=20)])
+    password = PasswordField('Password', validators=[InputRequired(), Length(min=6, max=20)])
+    submit = SubmitField('Sign In')
+
+class RegisterForm(FlaskForm):
+    email = EmailField('Email', validators=[InputRequired(), Email()])
+    username = StringField('Username', validators=[InputRequired(), Length(min=4, max=20)])
+    password = PasswordField('Password', validators=[InputRequired(), Length(min=6, max=20)])
+    confirm_password = PasswordField('Confirm Password', 
+                                   validators=[InputRequired(), 
+                                             EqualTo('password', message='Passwords must match')])
+    submit = SubmitField('Sign Up')
@@ -0,0 +1,144 @@
+# history_writer.py - Group-committed, optionally write-behind, history inserts
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+WRITE_MODES = ('sync', 'group', 'async')
+
+
+class _PendingRow:
+    __slots__ = ('values', 'done', 'error')
+
+    def __init__(self, values):
+        self.values = values
+        self.done = threading.Event()
+        self.error = None
+
+
+class HistoryWriter:
+    """Inserts analysis history rows with a configurable durability trade-off
+
+    sync   every request commits its own row before responding (the default).
+    group  requests queue their row and wait while a background thread
+           commits everything queued within `interval` seconds in a single
+           transaction; concurrent uploads share one commit instead of
+           contending for the SQLite write lock.  Group commits run with
+           synchronous=FULL whatever the connection's setting, so a row
+           survives power loss once the request returns.
+    async  like group, but the request returns as soon as the row is queued.
+           Rows still queued when the process dies are lost; they are
+           flushed at normal interpreter exit.
+    """
+
+    def __init__(self, app, db, model, mode='sync', interval=0.005, max_batch=500):
+        if mode not in WRITE_MODES:
+            raise ValueError(f'Unknown history write mode {mode!r} (expected one of {WRITE_MODES})')
+        self.app = app
+        self.db = db
+        self.model = model
+        self.mode = mode
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = []
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.rows = 0
+        if mode != 'sync':
+            atexit.register(self.flush)
+
+    def add(self, **values):
+        """Record one history row according to the write mode"""
+        if self.mode == 'sync':
+            self.db.session.add(self.model(**values))
+            self.db.session.commit()
+            return
+
+        # Stamp the row now so queueing delay never reorders the history
+        values.setdefault('analysis_date', datetime.utcnow())
+        pending = _PendingRow(values)
+        with self._cond:
+            self._start()
+            self._queue.append(pending)
+            self._cond.notify_all()
+        if self.mode == 'group':
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+
+    def flush(self, timeout=10):
+        """Wait until every queued row has been committed"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _start(self):
+        """Start the writer thread once per process (and again after a fork); caller holds the lock"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            # Let concurrent requests join this commit
+            time.sleep(self.interval)
+            with self._cond:
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+                self._busy = True
+            self._commit(batch)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _commit(self, batch):
+        error = None
+        try:
+            with self.app.app_context(), self.db.engine.connect() as connection:
+                durable = self.mode == 'group' and connection.dialect.name == 'sqlite'
+                if durable:
+                    # WAL with synchronous=NORMAL only fsyncs at checkpoints
+                    previous = connection.exec_driver_sql('PRAGMA synchronous').scalar()
+                    connection.exec_driver_sql('PRAGMA synchronous=FULL')
+                try:
+                    connection.execute(insert(self.model), [pending.values for pending in batch])
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    if durable:
+                        connection.exec_driver_sql(f'PRAGMA synchronous={int(previous)}')
+                        connection.commit()
+            self.batches += 1
+            self.rows += len(batch)
+        except Exception as e:
+            self.app.logger.exception('Could not write %d history rows: %s', len(batch), e)
+            error = e
+        for pending in batch:
+            pending.error = error
+            pending.done.set()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'mode': self.mode,
+                'queued': len(self._queue),
+                'batches': self.batches,
+                'rows': self.rows
+            }
@@ -0,0 +1,140 @@
+# jobs.py - Background runner for asynchronous analysis jobs
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+
+from engine import EngineBusy
+
+
+class JobRunner:
+    """Background thread that feeds pending analysis jobs to the analysis engine
+
+    Jobs live in the database, so work that was pending (or running in a
+    process that died) is picked up again after a restart.  A job is
+    claimed with a conditional UPDATE, which keeps several server
+    processes from running the same job twice.
+    """
+
+    def __init__(self, app, db, job_model, engine, on_complete=None,
+                 poll_interval=1.0, stale_after=600, read_upload=None):
+        self.app = app
+        self.db = db
+        self.Job = job_model
+        self.engine = engine
+        self.on_complete = on_complete
+        self.read_upload = read_upload or self._read_file
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the runner thread once per process (and again after a fork)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='analysis-jobs', daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Wake the runner up because a new job was queued"""
+        self.start()
+        self._wakeup.set()
+
+    def _claim(self):
+        """Atomically move the oldest runnable job to 'running' and return it"""
+        Job = self.Job
+        stale = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        candidates = (Job.query
+                      .filter((Job.status == 'pending') |
+                              ((Job.status == 'running') & (Job.started_at < stale)))
+                      .order_by(Job.created_at)
+                      .limit(5)
+                      .all())
+        for job in candidates:
+            claimed = (Job.query
+                       .filter_by(id=job.id, status=job.status, started_at=job.started_at)
+                       .update({'status': 'running', 'started_at': datetime.utcnow()},
+                               synchronize_session=False))
+            self.db.session.commit()
+            if claimed == 1:
+                return self.db.session.get(Job, job.id)
+        return None
+
+    def _read_file(self, job):
+        """Bytes of a job's upload, stored under its filename in the upload folder"""
+        with open(os.path.join(self.app.config['UPLOAD_FOLDER'], job.filename), 'rb') as f:
+            return f.read()
+
+    def _submit(self, job):
+        """Hand a claimed job to the engine, or fail it if its upload is gone"""
+        try:
+            data = self.read_upload(job)
+        except OSError as e:
+            self._finish(job.id, {'success': False, 'error': f'Upload missing: {e}'})
+            return None
+        return self.engine.submit(data, max_edge=self.app.config['ANALYSIS_MAX_EDGE'],
+                                  roi=self.app.config['ANALYSIS_ROI'],
+                                  backend=self.app.config['ANALYSIS_BACKEND'])
+
+    def _finish(self, job_id, result):
+        """Store the outcome of a job"""
+        job = self.db.session.get(self.Job, job_id)
+        if job is None:
+            return
+        job.status = 'done' if result.get('success') else 'failed'
+        job.result = json.dumps(result)
+        job.error = None if result.get('success') else result.get('error')
+        job.finished_at = datetime.utcnow()
+        if self.on_complete is not None:
+            self.on_complete(job, result)
+        self.db.session.commit()
+
+    def _run(self):
+        running = {}
+        while True:
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    # Keep the engine busy, but never queue more than it has workers
+                    while len(running) < max(self.engine.workers, 1):
+                        job = self._claim()
+                        if job is None:
+                            break
+                        try:
+                            future = self._submit(job)
+                        except EngineBusy:
+                            job.status = 'pending'
+                            job.started_at = None
+                            self.db.session.commit()
+                            break
+                        except Exception as e:
+                            # A job that cannot even be submitted would otherwise stay
+                            # 'running' until it went stale, then fail the same way again
+                            job_id = job.id
+                            self.db.session.rollback()
+                            self._finish(job_id, {'success': False, 'error': str(e)})
+                            continue
+                        if future is not None:
+                            running[future] = job.id
+
+                    if running:
+                        done, _ = wait(running, timeout=self.poll_interval,
+                                       return_when=FIRST_COMPLETED)
+                        for future in done:
+                            job_id = running.pop(future)
+                            try:
+                                result = future.result()
+                            except Exception as e:
+                                result = {'success': False, 'error': str(e)}
+                            self._finish(job_id, result)
+                        continue
+            except Exception as e:
+                self.app.logger.exception('Analysis job runner error: %s', e)
+                time.sleep(self.poll_interval)
+
+            self._wakeup.wait(self.poll_interval)
@@ -0,0 +1,87 @@
+# page_cache.py - Rendered-page cache for static informational routes
+import hashlib
+import threading
+from collections import OrderedDict
+
+from jinja2 import meta
+
+
+def template_version(env, name):
+    """Digest of a template's source and of every template it extends or includes"""
+    digest = hashlib.sha256()
+    pending, seen = [name], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        source, _, _ = env.loader.get_source(env, current)
+        digest.update(current.encode() + b'\0' + source.encode())
+        pending.extend(sorted(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref))
+    return digest.hexdigest()[:16]
+
+
+class PageCache:
+    """LRU cache of rendered pages with their ETags
+
+    Keys are built by the caller from the template version and whatever
+    else the page depends on (see app.render_cached).  A max_entries of 0
+    disables the cache.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, env, name):
+        """Template version of a page, computed once per template"""
+        version = self._versions.get(name)
+        if version is None:
+            version = self._versions[name] = template_version(env, name)
+        return version
+
+    def get(self, key):
+        """(etag, body) cached for key, or None"""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        """Cache a rendered page and return its (etag, body)"""
+        entry = (hashlib.sha256(body.encode()).hexdigest()[:20], body)
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
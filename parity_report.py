@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Parity Report for Reduced-Resolution Analysis
+Shows how far the features drift when images are analyzed at a bounded
+working resolution, and whether the risk level stays the same; with
+--backends, checks that every filter backend gives the same features
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from analysis import analysis_parity, backend_parity, FEATURE_TOLERANCE, PARITY_FEATURES
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif'}
+
+
+def collect_images(paths):
+    """Expand the given files and directories into a list of image paths"""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        images.append(os.path.join(root, name))
+        else:
+            images.append(path)
+    return images
+
+
+def summarize(reports):
+    """Aggregate drift and level agreement over all analyzed images"""
+    ok = [r for r in reports if r['success']]
+    summary = {
+        'images': len(reports),
+        'failed': len(reports) - len(ok),
+        'level_mismatches': sum(1 for r in ok if not r['level_match']),
+        'features': {}
+    }
+    for feature in PARITY_FEATURES:
+        deltas = [abs(r['drift'][feature]['delta']) for r in ok]
+        relative = [r['drift'][feature]['relative'] for r in ok]
+        summary['features'][feature] = {
+            'mean_abs_delta': sum(deltas) / len(deltas) if deltas else 0.0,
+            'max_abs_delta': max(deltas, default=0.0),
+            'max_relative': max(relative, default=0.0)
+        }
+    full = sum(r['full_seconds'] for r in ok)
+    reduced = sum(r['reduced_seconds'] for r in ok)
+    summary['speedup'] = full / reduced if reduced else None
+    return summary
+
+
+def backends_report(images, args):
+    """Compare every filter backend against PIL on each image"""
+    from filter_backends import BACKENDS
+
+    print(f"🔬 Parity report: filter backends ({', '.join(BACKENDS)}) vs pil")
+    print("=" * 78)
+    print(f"{'image':<30} " + ''.join(f"{name + ' Δ':>12}{name + ' ms':>10}" for name in BACKENDS))
+
+    reports = []
+    for path in images:
+        report = backend_parity(path)
+        report['path'] = path
+        reports.append(report)
+
+        name = os.path.basename(path)[:30]
+        if not report['success']:
+            print(f"{name:<30} ❌ {report['error']}")
+            continue
+        cells = ''.join(f"{report['drift'][backend]:>12.2g}{report['seconds'][backend] * 1000:>10.1f}"
+                        for backend in BACKENDS)
+        print(f"{name:<30} {cells}{'' if report['match'] else '  ⚠️'}")
+
+    mismatches = sum(1 for r in reports if r['success'] and not r['match'])
+    analyzed = sum(1 for r in reports if r['success'])
+    print("=" * 78)
+    print(f"✅ Backends agree within {FEATURE_TOLERANCE:g} for {analyzed - mismatches}/{analyzed} images")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'backends': list(BACKENDS), 'images': reports}, f, indent=2)
+        print(f"📝 Report written to {args.json_path}")
+
+    if args.strict and mismatches:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--max-edge', type=int, default=1024,
+                        help='long edge of the working resolution (default: 1024)')
+    parser.add_argument('--json', dest='json_path', help='write the full report to this file')
+    parser.add_argument('--backends', action='store_true',
+                        help='compare the filter backends at full resolution instead')
+    parser.add_argument('--strict', action='store_true',
+                        help='exit with status 1 if any risk level changes (or any backend disagrees)')
+    args = parser.parse_args()
+
+    images = collect_images(args.paths)
+    if not images:
+        print("❌ No images found")
+        sys.exit(1)
+
+    if args.backends:
+        backends_report(images, args)
+        return
+
+    print(f"🔬 Parity report: full resolution vs {args.max_edge}px long edge")
+    print("=" * 78)
+    print(f"{'image':<30} {'asym Δ':>9} {'color Δ':>9} {'border Δ':>9}  {'level':<20}")
+
+    reports = []
+    for path in images:
+        report = analysis_parity(path, args.max_edge)
+        report['path'] = path
+        reports.append(report)
+
+        name = os.path.basename(path)[:30]
+        if not report['success']:
+            print(f"{name:<30} ❌ {report['error']}")
+            continue
+        deltas = [report['drift'][f]['delta'] for f in PARITY_FEATURES]
+        level = report['full_level']
+        if not report['level_match']:
+            level = f"{report['full_level']} -> {report['reduced_level']} ⚠️"
+        print(f"{name:<30} {deltas[0]:>+9.2f} {deltas[1]:>+9.2f} {deltas[2]:>+9.2f}  {level:<20}")
+
+    summary = summarize(reports)
+    print("=" * 78)
+    for feature, stats in summary['features'].items():
+        print(f"{feature:<22} mean |Δ| {stats['mean_abs_delta']:.2f}  "
+              f"max |Δ| {stats['max_abs_delta']:.2f}  max rel {stats['max_relative']:.1%}")
+    if summary['speedup']:
+        print(f"⚡ Speedup: {summary['speedup']:.1f}x")
+    print(f"✅ Risk level unchanged for {summary['images'] - summary['failed'] - summary['level_mismatches']}"
+          f"/{summary['images'] - summary['failed']} images")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'max_edge': args.max_edge, 'summary': summary, 'images': reports}, f, indent=2)
+        print(f"📝 Report written to {args.json_path}")
+
+    if args.strict and summary['level_mismatches']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# result_cache.py - Content-hash cache for analysis results
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Two-tier cache of analysis results keyed by the hash of the uploaded bytes
+
+    The first tier is an in-process LRU bounded by the total size of the
+    cached JSON documents; the second is a SQLite table that survives
+    restarts and is shared by every worker process on the host.  The
+    table keeps at most about max_rows results: every PRUNE_EVERY writes a
+    process drops the oldest rows beyond that.
+    """
+
+    PRUNE_EVERY = 64
+
+    def __init__(self, db_path=None, max_bytes=32 * 1024 * 1024, version='', max_rows=50_000):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.version = version
+        self.max_rows = max_rows
+        self._writes = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key_for(self, data, *options):
+        """Build the cache key for uploaded bytes analyzed with the given options"""
+        digest = hashlib.sha256(data).hexdigest()
+        prefix = (self.version,) if self.version else ()
+        suffix = ':'.join(str(option) for option in prefix + options)
+        return f'{digest}:{suffix}'
+
+    def _connection(self):
+        """Per-thread SQLite connection, or None when the disk tier is disabled"""
+        if not self.db_path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                conn = sqlite3.connect(self.db_path, timeout=5)
+                conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS ix_results_created_at ON results (created_at)')
+            except (OSError, sqlite3.Error):
+                # Read-only or unavailable storage: keep serving from memory
+                self.db_path = None
+                return None
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _remember(self, key, value):
+        """Insert into the LRU tier, evicting the least recently used entries"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, key):
+        """Return a fresh copy of the cached result, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(value)
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                row = conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                with self._lock:
+                    self.disk_hits += 1
+                return json.loads(row[0])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Store a successful analysis result in both tiers"""
+        value = json.dumps(result)
+        self._remember(key, value)
+
+        conn = self._connection()
+        if conn is not None:
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)',
+                                 (key, value, time.time()))
+                    if self.max_rows and self._should_prune():
+                        self._prune(conn)
+            except sqlite3.Error:
+                pass
+
+    def _should_prune(self):
+        with self._lock:
+            self._writes += 1
+            return self._writes % self.PRUNE_EVERY == 1
+
+    def _prune(self, conn):
+        """Delete the oldest rows beyond max_rows"""
+        conn.execute('DELETE FROM results WHERE created_at <= '
+                     '(SELECT created_at FROM results ORDER BY created_at DESC LIMIT 1 OFFSET ?)',
+                     (self.max_rows,))
+
+    def stats(self):
+        """Hit/miss counters and current size of the memory tier"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'persistent': bool(self.db_path)
+            }
@@ -4,52 +4,16 @@ Skin Cancer Detection Tool - Smart Startup Script
 Always finds available port and opens browser automatically
 """
 
-import socket
-import subprocess
-import webbrowser
-import threading
-import time
-from app import app, db
-
-def find_free_port(start_port=5000):
-    """Find a free port starting from start_port"""
-    for port in range(start_port, start_port + 100):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            if sock.connect_ex(('127.0.0.1', port)) != 0:
-                return port
-    return None
-
-def kill_existing_processes():
-    """Kill any existing Flask processes"""
-    try:
-        subprocess.run(['pkill', '-f', 'python.*app.py'], capture_output=True)
-        subprocess.run(['pkill', '-f', 'python.*run.py'], capture_output=True)
-        subprocess.run(['pkill', '-f', 'Flask'], capture_output=True)
-        time.sleep(1)
-    except:
-        pass
-
-def open_browser_tab(url):
-    """Open URL in new browser tab after server starts"""
-    def delayed_open():
-        time.sleep(2)  # Wait for server to fully start
-        webbrowser.open_new_tab(url)
-        print(f"🌐 ✨ Opening {url} in your browser...")
-    
-    threading.Thread(target=delayed_open, daemon=True).start()
+from app import app, db, upgrade_schema, free_port, open_browser, services, warmup_in_background
 
 if __name__ == '__main__':
     print("🏥 🚀 Smart Startup - Skin Cancer Detection Tool")
     print("=" * 60)
     
-    # Clean up any existing processes
-    print("🧹 Cleaning up existing processes...")
-    kill_existing_processes()
-    
     # Find available port
-    port = find_free_port(5000)
+    port = free_port(5000)
     if not port:
-        print("❌ Could not find available port in range 5000-5100")
+        print("❌ Could not find an available port")
         exit(1)
     
     print(f"✅ Found available port: {port}")
@@ -60,8 +24,16 @@ if __name__ == '__main__':
     print("📊 Initializing database...")
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("✅ Database ready!")
     
+    # Pick up analysis jobs that were still pending when the server stopped
+    services(app).job_runner.start()
+    
+    # Load the imaging modules and analysis workers while the server starts
+    warmup_in_background()
+    services(app).upload_collector.start()
+    
     # Display enhanced features
     print("✨ Enhanced UI Features:")
     print("  🎆 45+ Advanced animations")
@@ -74,17 +46,18 @@ if __name__ == '__main__':
     
     # Auto-open browser
     url = f"http://localhost:{port}"
-    open_browser_tab(url)
+    open_browser(url, port)
     
     print("=" * 60)
     print(f"🚀 Starting server on {url}")
-    print("🌐 Browser will open automatically in 2 seconds...")
+    print("🌐 Browser will open automatically once the server is up...")
     print("🔄 Press Ctrl+C to stop the server")
+    print("ℹ️  Development server; use serve.py to run in production")
     print("=" * 60)
     
     # Start the Flask application
     try:
-        app.run(debug=True, port=port, host='127.0.0.1', use_reloader=False)
+        app.run(debug=app.debug, port=port, host='127.0.0.1', use_reloader=False)
     except KeyboardInterrupt:
         print("\n🛑 ✨ Application stopped by user")
         print("👋 Thanks for using the Skin Cancer Detection Tool!")
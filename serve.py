@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Production Server for Skin Cancer Detection Tool
+Runs the app under gunicorn: pre-forked workers share one listening socket,
+and the app, NumPy and PIL are loaded once in the master before forking
+
+Signals (send to the master, see --pidfile):
+  HUP    graceful worker restart: start fresh workers, then retire the old
+         ones.  Workers fork from the preloaded master, so HUP does not pick
+         up code changes; deploy new code with a full restart or with USR2
+  USR2   start a new master from the current code (then TERM the old one)
+  TERM   graceful shutdown (in-flight requests get --graceful-timeout seconds)
+  TTIN / TTOU   add / remove one worker
+"""
+
+import argparse
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def parse_args(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='\n'.join(__doc__.strip().splitlines()[3:]))
+    parser.add_argument('--bind', default=os.environ.get('SERVE_BIND', '127.0.0.1:5000'),
+                        help='address to listen on (env SERVE_BIND, default 127.0.0.1:5000)')
+    parser.add_argument('--workers', type=int, default=env_int('SERVE_WORKERS', cpus),
+                        help='web worker processes (env SERVE_WORKERS, default one per core)')
+    parser.add_argument('--threads', type=int, default=env_int('SERVE_THREADS', 4),
+                        help='request threads per worker (env SERVE_THREADS, default 4)')
+    parser.add_argument('--analysis-workers', type=int, default=None,
+                        help='analysis processes per web worker (env ANALYSIS_WORKERS, '
+                             'default: cores divided between the web workers)')
+    parser.add_argument('--timeout', type=int, default=env_int('SERVE_TIMEOUT', 120),
+                        help='seconds before a silent worker is killed and replaced')
+    parser.add_argument('--graceful-timeout', type=int, default=env_int('SERVE_GRACEFUL_TIMEOUT', 30),
+                        help='seconds workers get to finish requests on reload/shutdown')
+    parser.add_argument('--max-requests', type=int, default=env_int('SERVE_MAX_REQUESTS', 1000),
+                        help='recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--max-requests-jitter', type=int, default=env_int('SERVE_MAX_REQUESTS_JITTER', 100),
+                        help='random extra requests so workers do not recycle together')
+    parser.add_argument('--pidfile', default=os.environ.get('SERVE_PIDFILE'),
+                        help='write the master pid here (for kill -HUP)')
+    parser.add_argument('--log-level', default=os.environ.get('SERVE_LOG_LEVEL', 'info'))
+    args = parser.parse_args(argv)
+
+    if args.analysis_workers is None:
+        if 'ANALYSIS_WORKERS' in os.environ:
+            args.analysis_workers = int(os.environ['ANALYSIS_WORKERS'])
+        else:
+            args.analysis_workers = max(1, cpus // max(args.workers, 1))
+    return args
+
+
+def load_app():
+    """Import and initialize the app once, in the master, before any fork"""
+    from app import app, db, upgrade_schema, warmup
+
+    # NumPy, PIL and its image plugins are loaded once here and shared
+    # copy-on-write; the analysis pools are started per worker after the fork
+    warmup(start_engine=False)
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        # Connections must not be shared with the forked workers
+        db.engine.dispose()
+    return app
+
+
+def post_fork(server, worker):
+    """Per-worker setup after the fork"""
+    from app import app, db, services, warmup_in_background
+
+    with app.app_context():
+        # Drop any pooled connection inherited from the master without closing it
+        db.engine.dispose(close=False)
+    # Every worker runs a job runner; jobs are claimed atomically in the database
+    services(app).job_runner.start()
+    # Workers take turns collecting unused uploads (a lock file skips overlapping runs)
+    services(app).upload_collector.start()
+    # Start this worker's analysis processes without delaying its first request
+    warmup_in_background()
+
+
+def worker_exit(server, worker):
+    """Finish queued history writes and stop the analysis pool"""
+    from app import app, services
+
+    services(app).history_writer.flush()
+    services(app).engine.shutdown()
+
+
+class ProductionServer(BaseApplication):
+    """gunicorn application with the options built from the command line"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return load_app()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Read by app.py when the master preloads it
+    os.environ['ANALYSIS_WORKERS'] = str(args.analysis_workers)
+
+    print("🚀 Starting Skin Cancer Detection Tool (production server)")
+    print(f"📍 Listening on http://{args.bind}")
+    print(f"👷 {args.workers} workers x {args.threads} threads, "
+          f"{args.analysis_workers} analysis processes per worker")
+    print("=" * 50)
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'pidfile': args.pidfile,
+        'loglevel': args.log_level,
+        'accesslog': '-',
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+    ProductionServer(options).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# similarity.py - Per-user perceptual-hash index for matching earlier analyses
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import combinations
+
+HASH_BITS = 64
+CHUNKS = 4  # 16-bit chunks, one lookup table each
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return _popcount(a ^ b)
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(max_bits):
+    """Every chunk mask with at most max_bits bits set"""
+    return tuple(sum(1 << bit for bit in bits)
+                 for count in range(max_bits + 1)
+                 for bits in combinations(range(CHUNK_BITS), count))
+
+
+class HashIndex:
+    """Multi-index hashing of 64-bit hashes under the Hamming distance
+
+    Each hash is filed under its four 16-bit chunks.  Two hashes within
+    distance r must agree to within r // 4 bits in at least one chunk
+    (pigeonhole), so a search only probes the chunk values that close to
+    the query's and checks those candidates, instead of every hash.
+    """
+
+    def __init__(self):
+        self.items = {}  # hash -> items with that hash
+        self._tables = [{} for _ in range(CHUNKS)]
+        self.size = 0
+
+    def add(self, value, item):
+        """Insert a hash with the item it identifies"""
+        self.size += 1
+        items = self.items.get(value)
+        if items is not None:
+            items.append(item)
+            return
+        self.items[value] = [item]
+        for i, table in enumerate(self._tables):
+            table.setdefault((value >> (i * CHUNK_BITS)) & CHUNK_MASK, []).append(value)
+
+    def search(self, value, radius):
+        """(distance, item) for every hash within radius of value"""
+        masks = _flip_masks(min(radius // CHUNKS, CHUNK_BITS))
+        candidates = set()
+        for i, table in enumerate(self._tables):
+            chunk = (value >> (i * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for candidate in candidates:
+            distance = hamming(value, candidate)
+            if distance <= radius:
+                found.extend((distance, item) for item in self.items[candidate])
+        return found
+
+
+class SimilarityIndex:
+    """Hash indexes of each user's analyses, kept in memory per process
+
+    A user's index is loaded on first use and topped up before every
+    query with the rows added since (load_rows(user_id, after_id) returns
+    (id, hex hash) pairs in id order), so analyses recorded by other
+    server processes are found as well.  Stored hashes that are rewritten
+    rather than added (e.g. by a backfill) are picked up through
+    generation(), a counter shared by every process: when it changes, each
+    index is rebuilt on its next query.  Indexes of the least recently
+    queried users are dropped beyond max_users.
+    """
+
+    def __init__(self, load_rows, generation=None, max_users=1024):
+        self.load_rows = load_rows
+        self.generation = generation
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = {'index': HashIndex(), 'last_id': 0, 'generation': None,
+                                                'lock': threading.Lock()}
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return entry
+
+    def search(self, user_id, phash, radius, limit):
+        """(distance, analysis id) of the user's closest analyses within radius, nearest first"""
+        generation = self.generation() if self.generation is not None else None
+        entry = self._entry(user_id)
+        with entry['lock']:
+            if entry['generation'] != generation:
+                entry.update(index=HashIndex(), last_id=0, generation=generation)
+            for analysis_id, value in self.load_rows(user_id, entry['last_id']):
+                entry['index'].add(int(value, 16), analysis_id)
+                entry['last_id'] = analysis_id
+            found = entry['index'].search(int(phash, 16), radius)
+        # Newest first among equally close matches
+        found.sort(key=lambda match: (match[0], -match[1]))
+        return found[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
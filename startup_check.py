@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Startup Time Budget Check for Skin Cancer Detection Tool
+Measures, in fresh interpreters, how long importing and creating the app takes
+and how long the first page and the first analysis take, and fails when any
+median exceeds its budget (use it in CI or before changing imports).  Budgets
+are given explicitly, derived from a baseline recorded with --json on the
+same machine, or else DEFAULT_BUDGETS_MS.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Runs in a fresh interpreter so nothing is imported or cached beforehand
+PROBE = r'''
+import io, json, sys, time
+started = time.perf_counter()
+import app as application
+timings = {'import': time.perf_counter() - started}
+client = application.app.test_client()
+
+started = time.perf_counter()
+response = client.get('/login')
+timings['first_request'] = time.perf_counter() - started
+assert response.status_code == 200, response.status_code
+
+if sys.argv[1] == '1':
+    started = time.perf_counter()
+    application.warmup()
+    timings['warmup'] = time.perf_counter() - started
+from PIL import Image
+buffer = io.BytesIO()
+Image.new('RGB', (64, 48), (190, 140, 120)).save(buffer, 'PNG')
+started = time.perf_counter()
+response = client.post('/api/analyze', data={'file': (io.BytesIO(buffer.getvalue()), 'probe.png')})
+timings['first_analysis'] = time.perf_counter() - started
+assert response.get_json()['success'], response.get_json()
+print(json.dumps(timings))
+'''
+
+PHASES = ['import', 'first_request', 'warmup', 'first_analysis']
+
+# Budgets used without --baseline: about 1.7-2.5x the medians measured on a
+# CI runner (600ms, 130ms, 25ms), enough to fail on gross regressions with no
+# setup; a baseline recorded on the machine itself catches smaller ones
+DEFAULT_BUDGETS_MS = {
+    ('cold', 'import'): 1000,
+    ('cold', 'first_request'): 300,
+    ('warm', 'first_analysis'): 60,
+}
+
+
+def probe(warm):
+    """Time one cold start in a new process"""
+    env = dict(os.environ)
+    # Inline analysis and no persistent cache tier, so each run is cold and self-contained
+    env.update({'ANALYSIS_WORKERS': '0', 'RESULT_CACHE_DB': '', 'METRICS_ENABLED': '1'})
+    completed = subprocess.run([sys.executable, '-c', PROBE, '1' if warm else '0'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else 'probe failed')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per measurement, median is reported')
+    parser.add_argument('--import-budget-ms', type=float,
+                        help='budget for importing and creating the app (default %.0f)'
+                             % DEFAULT_BUDGETS_MS['cold', 'import'])
+    parser.add_argument('--first-request-budget-ms', type=float,
+                        help='budget for the first page rendered by a new process (default %.0f)'
+                             % DEFAULT_BUDGETS_MS['cold', 'first_request'])
+    parser.add_argument('--first-analysis-budget-ms', type=float,
+                        help='budget for the first analysis once warmup() has run (default %.0f)'
+                             % DEFAULT_BUDGETS_MS['warm', 'first_analysis'])
+    parser.add_argument('--baseline', help='medians written by an earlier --json run; budgets default '
+                                           'to these plus --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown over the baseline allowed before failing (0.25 = 25%%)')
+    parser.add_argument('--json', dest='json_path', help='write the medians to this file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['medians_ms']
+
+    print("⏱️  Startup time check")
+    print("=" * 50)
+    runs = {'cold': [], 'warm': []}
+    try:
+        for _ in range(args.runs):
+            runs['cold'].append(probe(warm=False))
+            runs['warm'].append(probe(warm=True))
+    except RuntimeError as e:
+        print(f"❌ Startup probe failed: {e}")
+        sys.exit(1)
+
+    medians = {}
+    for mode, results in runs.items():
+        medians[mode] = {phase: statistics.median(result[phase] for result in results) * 1000
+                         for phase in PHASES if phase in results[0]}
+        timings = ', '.join(f'{phase} {ms:.1f}ms' for phase, ms in medians[mode].items())
+        print(f"  {mode:5s} {timings}")
+    print(f"  (first analysis without warmup pays for loading NumPy and PIL: "
+          f"{medians['cold']['first_analysis']:.1f}ms)")
+
+    def budget(explicit, mode, phase):
+        if explicit is not None:
+            return explicit
+        if baseline is not None:
+            return baseline[mode][phase] * (1 + args.tolerance)
+        return DEFAULT_BUDGETS_MS[mode, phase]
+
+    budgets = [
+        ('import', medians['cold']['import'], budget(args.import_budget_ms, 'cold', 'import')),
+        ('first request', medians['cold']['first_request'],
+         budget(args.first_request_budget_ms, 'cold', 'first_request')),
+        ('first analysis after warmup', medians['warm']['first_analysis'],
+         budget(args.first_analysis_budget_ms, 'warm', 'first_analysis')),
+    ]
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'medians_ms': medians,
+                       'budgets_ms': {name: budget for name, _, budget in budgets}}, f, indent=2)
+
+    print("=" * 50)
+    failed = False
+    for name, ms, limit in budgets:
+        ok = ms <= limit
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {name}: {ms:.1f}ms (budget {limit:.0f}ms)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# thumbnails.py - Cached thumbnails and previews of uploaded images
+import functools
+import io
+import os
+
+# Long edge in pixels of each rendition (2x the size it is displayed at)
+RENDITIONS = {
+    'thumb': 96,
+    'preview': 800,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def output_format():
+    """(format, extension, save options) of renditions: WebP when Pillow supports it"""
+    from PIL import features
+
+    if features.check('webp'):
+        return 'WEBP', 'webp', {'quality': 80, 'method': 4}
+    return 'JPEG', 'jpg', {'quality': 85, 'optimize': True}
+
+
+def rendition_path(upload_folder, kind, filename):
+    """Where the given rendition of an upload is stored
+
+    filename may be a '/'-separated key such as a sharded blob location.
+    """
+    name = os.path.splitext(filename)[0] + '.' + output_format()[1]
+    return os.path.join(upload_folder, kind, *name.split('/'))
+
+
+def _save(image, path):
+    """Write a rendition atomically so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fmt, _, options = output_format()
+    temp = f'{path}.{os.getpid()}.tmp'
+    image.save(temp, fmt, **options)
+    os.replace(temp, path)
+
+
+def generate_renditions(source, upload_folder, filename):
+    """Create every rendition of an upload from its path or bytes"""
+    from PIL import Image, ImageOps
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    largest = max(RENDITIONS.values())
+    with _open_reduced(source, largest) as image:
+        # JPEGs are decoded at a reduced scale straight away
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        if output_format()[0] == 'JPEG' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+
+        # Largest first, each smaller one is resized from the previous
+        for kind, edge in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            _save(image, rendition_path(upload_folder, kind, filename))
+
+
+def _open_reduced(source, largest):
+    """Open an upload; very large TIFFs are box-reduced region by region instead"""
+    from PIL import Image
+    from analysis import TILED_MIN_PIXELS, reduce_tiled
+    from tiff_regions import open_regions
+
+    reader = open_regions(source)
+    if reader is None:
+        return Image.open(source)
+    with reader:
+        width, height = reader.size
+        if not reader.streamable or width * height <= TILED_MIN_PIXELS:
+            return Image.open(source)
+        image = reduce_tiled(reader, largest)
+        # Keep the orientation so exif_transpose still applies it
+        image.getexif()[0x0112] = reader.orientation
+        return image
+
+
+def ensure_rendition(upload_folder, kind, filename, original=None):
+    """Path of a rendition, generating it from the original if it is missing
+
+    The original is read from upload_folder/filename unless its path is
+    given.  Returns None when the original upload does not exist either.
+    """
+    path = rendition_path(upload_folder, kind, filename)
+    if not os.path.exists(path):
+        if original is None:
+            original = os.path.join(upload_folder, filename)
+        if not os.path.isfile(original):
+            return None
+        generate_renditions(original, upload_folder, filename)
+    return path
+
+
+def has_renditions(upload_folder, filename):
+    """Whether every rendition of an upload is already stored"""
+    return all(os.path.exists(rendition_path(upload_folder, kind, filename)) for kind in RENDITIONS)
+
+
+def remove_renditions(upload_folder, filename):
+    """Delete the stored renditions of an upload"""
+    for kind in RENDITIONS:
+        path = rendition_path(upload_folder, kind, filename)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,252 @@
+# tiff_regions.py - Region-by-region decoding of striped and tiled TIFF files
+import io
+import struct
+from collections import OrderedDict
+
+from PIL import Image, TiffImagePlugin
+
+# Decoded strips/tiles kept for reuse by neighbouring regions
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+# Largest single strip/tile we are willing to decode; files laid out in
+# bigger chunks (e.g. one strip for the whole image) cannot be streamed
+CHUNK_MAX_BYTES = 64 * 1024 * 1024
+# Rows per chunk when reading uncompressed strips
+RAW_STRIP_ROWS = 64
+
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*')
+
+# Tags describing how a strip or tile is encoded, copied into the
+# single-chunk TIFF that each chunk is decoded from
+ENCODING_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    531,  # YCbCrPositioning
+    532,  # ReferenceBlackWhite
+)
+
+
+class TiffRegionReader:
+    """Decodes rectangular regions of a TIFF without loading the whole image
+
+    Every strip or tile is stored (and compressed) independently, so each
+    one is re-wrapped as a tiny single-strip TIFF and decoded on its own
+    by Pillow/libtiff.  Memory use is bounded by the regions requested plus
+    CHUNK_CACHE_BYTES of decoded chunks, whatever the size of the image.
+    """
+
+    def __init__(self, source):
+        self._own_file = isinstance(source, (str, bytes)) or hasattr(source, '__fspath__')
+        self._fp = open(source, 'rb') if self._own_file else source
+        try:
+            # Opened directly so Pillow's whole-image decompression bomb
+            # check does not apply; chunk sizes are checked below instead
+            self._image = TiffImagePlugin.TiffImageFile(self._fp)
+        except Exception:
+            self.close()
+            raise
+        tags = self._image.tag_v2
+        self.size = self._image.size
+        self.mode = self._image.mode
+        self.orientation = tags.get(274, 1)  # Orientation
+        width, height = self.size
+
+        if TiffImagePlugin.TILEOFFSETS in tags:
+            self.chunk_size = (tags.get(322), tags.get(323))  # TileWidth, TileLength
+            self._offsets = tags[TiffImagePlugin.TILEOFFSETS]
+            self._counts = tags.get(325)  # TileByteCounts
+            self.tiled = True
+        else:
+            self.chunk_size = (width, min(tags.get(TiffImagePlugin.ROWSPERSTRIP, height), height))
+            self._offsets = tags.get(TiffImagePlugin.STRIPOFFSETS)
+            self._counts = tags.get(279)  # StripByteCounts
+            self.tiled = False
+            if tags.get(259, 1) == 1 and self._offsets is not None:
+                self._split_raw_strips()
+        chunk_width, chunk_height = self.chunk_size
+        self.columns = -(-width // chunk_width) if chunk_width else 0
+        self.rows = -(-height // chunk_height) if chunk_height else 0
+
+        self.streamable = (
+            tags.get(284, 1) == 1  # one plane per chunk (chunky pixels)
+            and self._offsets is not None and self._counts is not None
+            and self.columns * self.rows == len(self._offsets) == len(self._counts)
+            and chunk_width * chunk_height * len(self._image.getbands()) * 2 <= CHUNK_MAX_BYTES
+        )
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+    def _split_raw_strips(self):
+        """Address uncompressed strips in runs of RAW_STRIP_ROWS rows
+
+        Uncompressed rows sit at fixed offsets, so writers that store the
+        whole image as one strip can still be read a few rows at a time.
+        """
+        width, height = self.size
+        bits = self._image.tag_v2.get(258, (1,))
+        samples = self._image.tag_v2.get(277, 1)
+        bits_per_pixel = sum(bits) if len(bits) == samples else bits[0] * samples
+        row_bytes = (width * bits_per_pixel + 7) // 8
+        rows_per_strip = self.chunk_size[1]
+        # Chunks must not straddle strips, so use a divisor of the strip height
+        step = max(rows for rows in range(1, min(rows_per_strip, RAW_STRIP_ROWS) + 1)
+                   if rows_per_strip % rows == 0)
+        offsets = []
+        for strip, offset in enumerate(self._offsets):
+            strip_rows = min(rows_per_strip, height - strip * rows_per_strip)
+            offsets.extend(offset + row * row_bytes for row in range(0, strip_rows, step))
+        self.chunk_size = (width, step)
+        self._offsets = offsets
+        self._counts = [min(step, height - index * step) * row_bytes for index in range(len(offsets))]
+
+    def close(self):
+        if self._own_file and self._fp is not None:
+            self._fp.close()
+        self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def chunk_box(self, index):
+        """(left, top, right, bottom) of a strip or tile, clipped to the image"""
+        chunk_width, chunk_height = self.chunk_size
+        left = (index % self.columns) * chunk_width
+        top = (index // self.columns) * chunk_height
+        return (left, top, min(left + chunk_width, self.size[0]),
+                min(top + chunk_height, self.size[1]))
+
+    def chunks(self):
+        """Yield (box, image) for every strip or tile in file order"""
+        for index in range(len(self._offsets)):
+            yield self.chunk_box(index), self._decode(index)
+
+    def region(self, box):
+        """Decode the pixels inside box, assembled from the chunks it overlaps"""
+        left, top, right, bottom = box
+        chunk_width, chunk_height = self.chunk_size
+        canvas = None
+        for row in range(top // chunk_height, (bottom - 1) // chunk_height + 1):
+            for column in range(left // chunk_width, (right - 1) // chunk_width + 1):
+                index = row * self.columns + column
+                chunk = self._chunk(index)
+                chunk_left, chunk_top, _, _ = self.chunk_box(index)
+                if canvas is None:
+                    canvas = Image.new(chunk.mode, (right - left, bottom - top))
+                    if chunk.mode == 'P':
+                        canvas.putpalette(chunk.getpalette())
+                crop = (max(left, chunk_left) - chunk_left, max(top, chunk_top) - chunk_top,
+                        min(right - chunk_left, chunk.size[0]), min(bottom - chunk_top, chunk.size[1]))
+                canvas.paste(chunk.crop(crop), (max(left, chunk_left) - left, max(top, chunk_top) - top))
+        return canvas
+
+    def window(self, box):
+        """A RegionWindow onto part of the image"""
+        return RegionWindow(self, box)
+
+    def _chunk(self, index):
+        """Decoded chunk through the LRU cache"""
+        chunk = self._cache.get(index)
+        if chunk is not None:
+            self._cache.move_to_end(index)
+            return chunk
+        chunk = self._decode(index)
+        self._cache[index] = chunk
+        self._cache_bytes += _image_bytes(chunk)
+        while self._cache_bytes > CHUNK_CACHE_BYTES and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= _image_bytes(evicted)
+        return chunk
+
+    def _decode(self, index):
+        """Decode one strip or tile as a standalone single-strip TIFF"""
+        self._fp.seek(self._offsets[index])
+        data = self._fp.read(self._counts[index])
+        left, top, right, bottom = self.chunk_box(index)
+        # Tiles are always stored at full tile size; strips only as tall as they are
+        width, height = self.chunk_size if self.tiled else (right - left, bottom - top)
+
+        tags = self._image.tag_v2
+        prefix = tags.prefix
+        endian = '>' if prefix == b'MM' else '<'
+        ifh = prefix + struct.pack(endian + 'HL', 42, 8)
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh)
+        for tag in ENCODING_TAGS:
+            if tag in tags:
+                ifd[tag] = tags[tag]
+                ifd.tagtype[tag] = tags.tagtype[tag]
+        for tag, value in ((256, width), (257, height), (278, height)):
+            ifd[tag] = value
+            ifd.tagtype[tag] = TiffImagePlugin.TiffTags.LONG
+        # tobytes() moves the strip offset past the directory, where the data goes
+        ifd[TiffImagePlugin.STRIPOFFSETS] = 0
+        ifd[279] = len(data)
+        ifd.tagtype[TiffImagePlugin.STRIPOFFSETS] = ifd.tagtype[279] = TiffImagePlugin.TiffTags.LONG
+
+        chunk = TiffImagePlugin.TiffImageFile(io.BytesIO(ifh + ifd.tobytes(8) + data))
+        chunk.load()
+        if chunk.size != (right - left, bottom - top):
+            chunk = chunk.crop((0, 0, right - left, bottom - top))
+        return chunk
+
+
+class RegionWindow:
+    """A rectangle of a TiffRegionReader that can be read like a whole image"""
+
+    def __init__(self, reader, box):
+        self.reader = reader
+        self.box = box
+        self.size = (box[2] - box[0], box[3] - box[1])
+        self.mode = reader.mode
+        self.tiled = reader.tiled
+
+    def region(self, box):
+        left, top = self.box[:2]
+        return self.reader.region((box[0] + left, box[1] + top, box[2] + left, box[3] + top))
+
+    def chunks(self):
+        """Yield (box, image) for the part of each strip or tile inside the window"""
+        left, top, right, bottom = self.box
+        chunk_width, chunk_height = self.reader.chunk_size
+        for row in range(top // chunk_height, (bottom - 1) // chunk_height + 1):
+            for column in range(left // chunk_width, (right - 1) // chunk_width + 1):
+                chunk_left, chunk_top, chunk_right, chunk_bottom = \
+                    self.reader.chunk_box(row * self.reader.columns + column)
+                box = (max(left, chunk_left) - left, max(top, chunk_top) - top,
+                       min(right, chunk_right) - left, min(bottom, chunk_bottom) - top)
+                yield box, self.region(box)
+
+
+def _image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def open_regions(source):
+    """TiffRegionReader for a TIFF path or file object, or None for other formats"""
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as f:
+            if f.read(4) not in TIFF_SIGNATURES:
+                return None
+        return TiffRegionReader(source)
+
+    position = source.tell()
+    try:
+        if source.read(4) not in TIFF_SIGNATURES:
+            return None
+        source.seek(position)
+        return TiffRegionReader(source)
+    finally:
+        # Leave the stream where it was for a regular Image.open()
+        source.seek(position)
@@ -0,0 +1,202 @@
+# validation.py - Early rejection of uploads that are not images we can analyze
+import io
+import struct
+
+# Leading bytes of every accepted upload format
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+)
+SNIFF_BYTES = 8
+# Headers (EXIF, ICC profiles, ...) longer than this are treated as malformed
+HEADER_LIMIT = 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload is not an acceptable image"""
+
+
+def sniff_format(header):
+    """Image format named by the magic bytes at the start of header, or None"""
+    for signature, fmt in SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    return None
+
+
+def _tiff_endian(header):
+    return '<' if header.startswith(b'II') else '>'
+
+
+def check_tiff(source, max_pixels, complete=False, max_tiff_pixels=None):
+    """check_header for a TIFF held in a seekable file (the upload received so far)
+
+    Large TIFFs usually store their first directory after the pixel data.
+    Its offset comes from the 8-byte file header; nothing is parsed until
+    the directory itself has arrived, and then only the directory and the
+    tag values it points to are read from the file, so the pixel data is
+    never buffered a second time.
+    """
+    from tiff_regions import TiffRegionReader
+
+    received = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    header = source.read(SNIFF_BYTES)
+    if len(header) < SNIFF_BYTES:
+        if complete:
+            raise UploadRejected('Unreadable TIFF image header')
+        return None
+    endian = _tiff_endian(header)
+    offset = struct.unpack(endian + 'I', header[4:8])[0]
+    limit = offset + HEADER_LIMIT
+    if not complete:
+        if received < offset + 2:
+            return None
+        source.seek(offset)
+        entries = struct.unpack(endian + 'H', source.read(2))[0]
+        if received < offset + 2 + 12 * entries + 4:
+            # The directory has not arrived yet
+            return None
+
+    try:
+        # Parsed without Pillow's bomb check; the limits below apply instead
+        source.seek(0)
+        reader = TiffRegionReader(source)
+        width, height = reader.size
+        if reader.streamable and max_tiff_pixels:
+            max_pixels = max(max_pixels, max_tiff_pixels)
+    except Exception:
+        if complete or received >= limit:
+            raise UploadRejected('Unreadable TIFF image header')
+        # Tag values stored after the directory are still on their way
+        return None
+
+    if width * height > max_pixels:
+        raise UploadRejected(f'Image is too large ({width}x{height} pixels, '
+                             f'limit is {max_pixels} pixels)')
+    return 'TIFF', (width, height)
+
+
+def check_header(header, max_pixels, complete=False, max_tiff_pixels=None):
+    """Validate the leading bytes of an upload
+
+    Returns (format, (width, height)), or None when more bytes are needed
+    to decide.  complete=True means header holds everything there is.
+    Only the header is parsed; no pixel data is decoded.  TIFFs that can
+    be analyzed region by region may have up to max_tiff_pixels pixels.
+    """
+    from PIL import Image
+
+    fmt = sniff_format(header)
+    if fmt is None:
+        if len(header) < SNIFF_BYTES and not complete:
+            return None
+        raise UploadRejected('Not a PNG, JPEG, GIF, BMP or TIFF image')
+    if fmt == 'TIFF':
+        return check_tiff(io.BytesIO(header), max_pixels, complete, max_tiff_pixels)
+
+    try:
+        with Image.open(io.BytesIO(header), formats=[fmt]) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise UploadRejected(f'Image has too many pixels (limit is {max_pixels} pixels)')
+    except Exception:
+        if complete or len(header) >= HEADER_LIMIT:
+            raise UploadRejected(f'Unreadable {fmt} image header')
+        return None
+
+    if width * height > max_pixels:
+        raise UploadRejected(f'Image is too large ({width}x{height} pixels, '
+                             f'limit is {max_pixels} pixels)')
+    return fmt, (width, height)
+
+
+class HeaderSniffer:
+    """Write-through wrapper that validates an upload while it is being received
+
+    Werkzeug writes each uploaded file part into the stream returned by
+    Request._get_file_stream.  Wrapping that stream lets the header be
+    checked as soon as its bytes arrive; once an upload is rejected the
+    rest of its data is dropped instead of being buffered or spooled.
+    TIFFs are not buffered here at all: their directory is read back from
+    the stream once enough bytes have been written (see check_tiff).
+    """
+
+    def __init__(self, stream, max_pixels, max_tiff_pixels=None):
+        self._stream = stream
+        self.max_pixels = max_pixels
+        self.max_tiff_pixels = max_tiff_pixels
+        self._header = bytearray()
+        self._tiff_wait = None  # bytes to receive before the TIFF directory is looked at again
+        self._received = 0
+        self.info = None
+        self.rejected = None
+
+    def write(self, data):
+        if self.rejected is not None:
+            return len(data)
+        if self.info is not None:
+            return self._stream.write(data)
+        self._received += len(data)
+        if self._tiff_wait is None:
+            self._header += data
+            if len(self._header) >= SNIFF_BYTES and sniff_format(bytes(self._header[:SNIFF_BYTES])) == 'TIFF':
+                offset = struct.unpack(_tiff_endian(self._header) + 'I', self._header[4:8])[0]
+                self._tiff_wait = offset + 2
+                self._header = None
+            else:
+                try:
+                    self.info = check_header(bytes(self._header), self.max_pixels,
+                                             max_tiff_pixels=self.max_tiff_pixels)
+                except UploadRejected as e:
+                    return self._reject(e, len(data))
+                if self.info is not None:
+                    self._header = None
+                return self._stream.write(data)
+
+        written = self._stream.write(data)
+        if self._received >= self._tiff_wait:
+            position = self._stream.tell()
+            try:
+                self.info = check_tiff(self._stream, self.max_pixels, max_tiff_pixels=self.max_tiff_pixels)
+            except UploadRejected as e:
+                return self._reject(e, len(data))
+            self._stream.seek(position)
+            # Until the directory (and the values after it) are complete,
+            # look again with each further chunk
+            self._tiff_wait = self._received + 1
+        return written
+
+    def _reject(self, error, size):
+        self.rejected = error
+        self._header = None
+        # Nothing of a rejected upload is kept
+        self._stream.seek(0)
+        self._stream.truncate()
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def validate_upload(file, max_pixels, max_tiff_pixels=None):
+    """Format and size of an uploaded FileStorage; raises UploadRejected if unacceptable"""
+    stream = file.stream
+    if getattr(stream, 'rejected', None) is not None:
+        raise stream.rejected
+    info = getattr(stream, 'info', None)
+    if info is None:
+        # Short files end before the sniffer could decide
+        stream.seek(0)
+        header = stream.read(HEADER_LIMIT)
+        if sniff_format(header) == 'TIFF':
+            info = check_tiff(stream, max_pixels, complete=True, max_tiff_pixels=max_tiff_pixels)
+        else:
+            info = check_header(header, max_pixels, complete=True, max_tiff_pixels=max_tiff_pixels)
+        stream.seek(0)
+    return info